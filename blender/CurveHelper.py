@@ -2,6 +2,8 @@ import bpy
 import bmesh
 import math
 import mathutils
+import numpy as np
+from functools import lru_cache
 
 #https://blender.stackexchange.com/questions/34145/calculate-points-on-a-nurbs-curve-without-converting-to-mesh
 
@@ -12,13 +14,16 @@ def macro_segmentsu(nu):
     return nu.point_count_u if nu.use_cyclic_u else nu.point_count_u - 1
 
 def makeknots(nu):
-    knots = [0.0] * (4 + macro_knotsu(nu))
-    flag = nu.use_endpoint_u + (nu.use_bezier_u << 1)
-    if nu.use_cyclic_u:
-        calcknots(knots, nu.point_count_u, nu.order_u, 0)
-        makecyclicknots(knots, nu.point_count_u, nu.order_u)
+    return makeknots_from_params(nu.point_count_u, nu.order_u, nu.use_cyclic_u, nu.use_endpoint_u, nu.use_bezier_u)
+
+def makeknots_from_params(pnts, order, cyclic, endpoint, bezier):
+    knots = [0.0] * (4 + order + pnts + (order - 1 if cyclic else 0))
+    flag = endpoint + (bezier << 1)
+    if cyclic:
+        calcknots(knots, pnts, order, 0)
+        makecyclicknots(knots, pnts, order)
     else:
-        calcknots(knots, nu.point_count_u, nu.order_u, flag)
+        calcknots(knots, pnts, order, flag)
     return knots
 
 def calcknots(knots, pnts, order, flag):
@@ -185,6 +190,112 @@ def nurb_make_curve(nu, resolu, stride):
 
     return coord_array
 
+def nurb_sample_params(knots, order, pnts, cyclic, resolu):
+    """u parameters nurb_make_curve evaluates at, resolu is per segment"""
+    segments = pnts if cyclic else pnts - 1
+    resolu = resolu * segments
+    ustart = knots[order - 1]
+    uend = knots[pnts + order - 1] if cyclic else knots[pnts]
+    ustep = (uend - ustart) / (resolu - (0 if cyclic else 1))
+    u = np.full(resolu, ustep)
+    u[0] = ustart
+    return np.cumsum(u)  # same as u += ustep in nurb_make_curve
+
+def basisNurb_np(u, order, pnts, knots):
+    """basisNurb for array of u at once. pnts already includes cyclic points.
+    returns (len(u), order + pnts - 1) array of basis function values"""
+    knots = np.asarray(knots, dtype=np.float64)
+    opp2 = order + pnts - 1
+    t = np.clip(u, knots[0], knots[opp2])[:, None]  # this is for float inaccuracy
+    k0 = knots[:opp2]
+    k1 = knots[1:opp2 + 1]
+
+    # this part is order '1' - first span that contains t
+    in_span = (k0 != k1) & (t >= k0) & (t <= k1)
+    basis = np.zeros((len(t), opp2 + 1))
+    has_span = in_span.any(axis=1)
+    basis[has_span, np.argmax(in_span[has_span], axis=1)] = 1.0
+
+    # this is order 2, 3, ...
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for j in range(2, order + 1):
+            i = np.arange(opp2 - j + 1)
+            d = np.where(basis[:, i] != 0.0, ((t - knots[i]) * basis[:, i]) / (knots[i + j - 1] - knots[i]), 0.0)
+            e = np.where(basis[:, i + 1] != 0.0, ((knots[i + j] - t) * basis[:, i + 1]) / (knots[i + j] - knots[i + 1]), 0.0)
+            basis[:, i] = d + e
+            basis[:, opp2 - j + 1:] = 0.0
+    return basis[:, :opp2]
+
+def nurb_basis_matrix(knots, order, pnts, cyclic, resolu):
+    """(samples x control points) basis matrix, cyclic basis functions are folded back onto first points"""
+    cycl = order - 1 if cyclic else 0
+    u = nurb_sample_params(knots, order, pnts, cyclic, resolu)
+    basis = basisNurb_np(u, order, pnts + cycl, knots)[:, :pnts + cycl]
+    matrix = basis[:, :pnts].copy()
+    matrix[:, :cycl] += basis[:, pnts:]
+    return matrix
+
+def nurb_eval_basis(basis, co, weights):
+    """evaluate splines with precomputed basis matrix
+    co: (P, 3) or (N, P, 3) control points, weights: (P,) or (N, P)
+    returns (S, 3) or (N, S, 3) positions"""
+    EPS = 1e-6
+    co = np.asarray(co, dtype=np.float64)
+    weights = np.asarray(weights, dtype=np.float64)
+    sumdiv = np.matmul(basis, weights[..., None])  # (.., S, 1)
+    coords = np.matmul(basis, co[..., :3] * weights[..., None])
+    normalize = (sumdiv != 0.0) & ((sumdiv < 1.0 - EPS) | (sumdiv > 1.0 + EPS))
+    return np.where(normalize, coords / np.where(normalize, sumdiv, 1.0), coords)
+
+def nurb_evaluate(co, weights, order, knots, resolu, cyclic=False):
+    """numpy version of nurb_make_curve. Works for one spline or for batch of splines with same order and point count
+    co: (P, 3) or (N, P, 3) control points, weights: (P,) or (N, P), knots: from makeknots
+    returns (S, 3) or (N, S, 3) positions"""
+    co = np.asarray(co)
+    basis = nurb_basis_matrix(knots, order, co.shape[-2], cyclic, resolu)
+    return nurb_eval_basis(basis, co, weights)
+
+@lru_cache(maxsize=64)
+def get_nurb_basis_matrix(pnts, order, cyclic, endpoint, bezier, resolu):
+    """cached nurb_basis_matrix - splines with same topology share same basis matrix.
+    Use get_nurb_basis_matrix.cache_info() for hits/misses"""
+    knots = makeknots_from_params(pnts, order, cyclic, endpoint, bezier)
+    matrix = nurb_basis_matrix(knots, order, pnts, cyclic, resolu)
+    matrix.flags.writeable = False  # shared between callers
+    return matrix
+
+def nurb_topology_key(nu, resolu):
+    """get_nurb_basis_matrix args for spline. Endpoint/bezier flags are ignored by cyclic knots"""
+    cyclic = bool(nu.use_cyclic_u)
+    return (nu.point_count_u, nu.order_u, cyclic, bool(nu.use_endpoint_u) and not cyclic, bool(nu.use_bezier_u) and not cyclic, resolu)
+
+def nurb_make_curve_np(nu, resolu):
+    """nurb_make_curve for bpy spline, returns (S, 3) array"""
+    co = np.empty(nu.point_count_u * 4, dtype=np.float32)
+    nu.points.foreach_get('co', co)
+    co = co.reshape(-1, 4)
+    return nurb_eval_basis(get_nurb_basis_matrix(*nurb_topology_key(nu, resolu)), co[:, :3], co[:, 3])
+
+def nurb_make_curves_np(splines, resolu):
+    """nurb_make_curve for many bpy splines. Splines are grouped by topology and each group is
+    evaluated with one batched matmul against shared basis matrix.
+    returns list of (S, 3) arrays in same order as splines"""
+    groups = {}
+    for idx, nu in enumerate(splines):
+        groups.setdefault(nurb_topology_key(nu, resolu), []).append(idx)
+
+    out = [None] * len(splines)
+    for key, indices in groups.items():
+        pnts = key[0]
+        co = np.empty((len(indices), pnts * 4), dtype=np.float32)
+        for row, idx in zip(co, indices):
+            splines[idx].points.foreach_get('co', row)
+        co = co.reshape(len(indices), pnts, 4)
+        coords = nurb_eval_basis(get_nurb_basis_matrix(*key), co[..., :3], co[..., 3])
+        for idx, c in zip(indices, coords):
+            out[idx] = c
+    return out
+
 #for testing
 if __name__ == "__main__":
     curve = bpy.data.curves['NurbsCurve']
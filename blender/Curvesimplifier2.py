@@ -17,7 +17,7 @@ import bpy
 import math
 import numpy as np
 from bpy.props import EnumProperty, FloatProperty, BoolProperty, IntProperty, StringProperty
-from resample2d import interpol_Catmull_Rom, get_strand_proportions
+from resample2d import interpol_Catmull_Rom, get_strand_proportions, interpol_Catmull_Rom_packed, interp_packed
    
 def SimplifyCurve(context, curveObj, numPointsToKeep):
 
@@ -69,3 +69,60 @@ def SimplifyCurve(context, curveObj, numPointsToKeep):
 
     curveData.resolution_u = 12
     return curveObj
+
+
+def SimplifyCurves(context, curveObjs, numPointsToKeep):
+    """SimplifyCurve for many curves at once (all splines of each curve).
+    Points are read with foreach_get, all strands are resampled in one pass and written back with foreach_set"""
+
+    selectedSplines = []
+    for curveObj in curveObjs:
+        for polyline in curveObj.data.splines:
+            if polyline.type == 'NURBS' or polyline.type == 'POLY':
+                points = polyline.points
+            else:
+                points = polyline.bezier_points
+            if len(points) > 1:  # skip single points
+                selectedSplines.append((curveObj, points))
+    if not selectedSplines:
+        return curveObjs
+
+    counts = np.array([len(points) for curveObj, points in selectedSplines], dtype=np.intp)
+    offsets = np.zeros(len(counts) + 1, dtype=np.intp)
+    np.cumsum(counts, out=offsets[1:])
+    pointsCo = np.empty((offsets[-1], 3), dtype=np.float32)
+    pointsRadius = np.empty(offsets[-1], dtype=np.float32)
+    pointsTilt = np.empty(offsets[-1], dtype=np.float32)
+    for (curveObj, points), start, end in zip(selectedSplines, offsets[:-1], offsets[1:]):
+        co = np.empty((end - start) * len(points[0].co), dtype=np.float32)  # 4 for points, 3 for bezier_points
+        points.foreach_get('co', co)
+        pointsCo[start:end] = co.reshape(end - start, -1)[:, :3]
+        points.foreach_get('radius', pointsRadius[start:end])
+        points.foreach_get('tilt', pointsTilt[start:end])
+
+    uniformPointSpacing = True
+    equalPointCount = True
+    splinePoints, splineOffsets = interpol_Catmull_Rom_packed(pointsCo, offsets, numPointsToKeep, uniform_spacing = uniformPointSpacing, same_point_count= equalPointCount)
+
+    # t for radius and tilt: <0,1> over point index, same as np.interp(t_ins_y, t_rad, radii) for each strand
+    point_ids = np.repeat(np.arange(len(counts)), counts)
+    t_rad = (np.arange(offsets[-1]) - offsets[point_ids]) / (counts[point_ids] - 1)
+    t_ins_y = np.tile(np.arange(numPointsToKeep) / (numPointsToKeep - 1), len(counts))
+    interpolRad = interp_packed(t_ins_y, splineOffsets, t_rad, offsets, pointsRadius)
+    interpolTilt = interp_packed(t_ins_y, splineOffsets, t_rad, offsets, pointsTilt)
+
+    np_splinePointsOnes = np.ones((len(splinePoints), 4), dtype=np.float32)  # 4 coord x,y,z ,1
+    np_splinePointsOnes[:, :3] = splinePoints
+
+    for curveObj in curveObjs:
+        curveObj.data.splines.clear()
+        curveObj.data.resolution_u = 12
+
+    for (curveObj, points), start, end in zip(selectedSplines, splineOffsets[:-1], splineOffsets[1:]):  # for each strand/ring
+        polyline = curveObj.data.splines.new('POLY')
+        polyline.points.add(numPointsToKeep - 1)
+        polyline.points.foreach_set('co', np_splinePointsOnes[start:end].ravel())
+        polyline.points.foreach_set('radius', interpolRad[start:end])
+        polyline.points.foreach_set('tilt', interpolTilt[start:end])
+
+    return curveObjs
@@ -0,0 +1,71 @@
+'''
+Binary .tfx and .tfxbone writers, same layout as the Maya exporter writes.
+Strand data goes to the file straight from numpy buffers.
+'''
+
+import ctypes
+import numpy as np
+
+
+class TressFXTFXFileHeader(ctypes.Structure):
+    _fields_ = [('version', ctypes.c_float),
+                ('numHairStrands', ctypes.c_uint),
+                ('numVerticesPerStrand', ctypes.c_uint),
+                ('offsetVertexPosition', ctypes.c_uint),
+                ('offsetStrandUV', ctypes.c_uint),
+                ('offsetVertexUV', ctypes.c_uint),
+                ('offsetStrandThickness', ctypes.c_uint),
+                ('offsetVertexColor', ctypes.c_uint),
+                ('reserved', ctypes.c_uint * 32)]
+
+
+def GetStrandSkinningDtype(NumJoints):
+    """one .tfxbone strand record: strand index followed by NumJoints (joint index, weight) pairs"""
+    return np.dtype([('index', '<i4'), ('pairs', [('joint', '<i4'), ('weight', '<f4')], (NumJoints,))])
+
+
+def SaveTFXBinaryFile(FilePath, Positions, UVs=None):
+    """Positions - (N, numVerticesPerStrand, 4) strand vertices, w is inverse mass. UVs - (N, 2) strand texture coords or None"""
+    numHairStrands, numVerticesPerStrand = Positions.shape[:2]
+    Positions = np.ascontiguousarray(Positions, dtype='<f4')
+
+    tfxHeader = TressFXTFXFileHeader()
+    tfxHeader.version = 4.0
+    tfxHeader.numHairStrands = numHairStrands
+    tfxHeader.numVerticesPerStrand = numVerticesPerStrand
+    tfxHeader.offsetVertexPosition = ctypes.sizeof(TressFXTFXFileHeader)
+    tfxHeader.offsetStrandUV = 0
+    tfxHeader.offsetVertexUV = 0
+    tfxHeader.offsetStrandThickness = 0
+    tfxHeader.offsetVertexColor = 0
+    if UVs is not None:
+        tfxHeader.offsetStrandUV = tfxHeader.offsetVertexPosition + Positions.nbytes
+
+    with open(FilePath, 'wb') as f:
+        f.write(tfxHeader)
+        Positions.tofile(f)
+        if UVs is not None:
+            np.ascontiguousarray(UVs, dtype='<f4').tofile(f)
+
+
+def SaveTFXBoneBinaryFile(FilePath, BoneNames, Joints, Weights):
+    """BoneNames - joint index -> bone name. Joints, Weights - (N, TRESSFX_MAX_INFLUENTIAL_BONE_COUNT) per strand,
+    joints of zero weights are written as 0"""
+    StrandsSkinning = np.zeros(len(Joints), dtype=GetStrandSkinningDtype(Joints.shape[1]))
+    StrandsSkinning['index'] = np.arange(len(Joints))
+    StrandsSkinning['pairs']['joint'] = np.where(Weights > 0, Joints, 0)
+    StrandsSkinning['pairs']['weight'] = Weights
+
+    with open(FilePath, 'wb') as f:
+        # Number of Bones
+        f.write(ctypes.c_int(len(BoneNames)))
+        # Write all bone (joint) names, null terminated
+        for BoneIndex, BoneName in enumerate(BoneNames):
+            EncodedName = BoneName.encode('utf-8') + b'\0'
+            f.write(ctypes.c_int(BoneIndex))
+            f.write(ctypes.c_int(len(EncodedName)))
+            f.write(EncodedName)
+
+        # Number of Strands
+        f.write(ctypes.c_int(len(StrandsSkinning)))
+        StrandsSkinning.tofile(f)
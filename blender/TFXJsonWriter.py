@@ -0,0 +1,136 @@
+'''
+Streaming writer for .tfxjson files.
+Lists are written element by element from numpy arrays, so the whole file never has to be in memory as python objects
+or as one big string.
+'''
+
+import os
+import json
+import math
+
+import numpy as np
+
+# float32 values survive a round trip through 9 significant digits
+FLOAT_FORMAT = '%.9g'
+# number of list elements joined before each write
+CHUNK_SIZE = 1024
+
+
+def FormatFloat(Value):
+    """one float as json. FLOAT_FORMAT would write nan and inf, which are not json,
+    non finite values are written the way json.dumps writes them (NaN, Infinity, -Infinity)"""
+    if math.isfinite(Value):
+        return FLOAT_FORMAT % Value
+    return json.dumps(Value)
+
+
+def FormatRows(Rows, RowFormat):
+    """yields RowFormat % values of the row, for every row of Rows (float array, rows along the first axis).
+    the values must be formatted with FLOAT_FORMAT in RowFormat"""
+    bRowFinite = np.isfinite(Rows).reshape(len(Rows), -1).all(axis=1)
+    # rows with a non finite value fill already formatted strings into RowFormat instead
+    NonFiniteRowFormat = RowFormat.replace(FLOAT_FORMAT, '%s')
+    for Row, bFinite in zip(Rows, bRowFinite.tolist()):
+        if bFinite:
+            yield RowFormat % tuple(Row.ravel().tolist())
+        else:
+            yield NonFiniteRowFormat % tuple(FormatFloat(Value) for Value in Row.ravel().tolist())
+
+
+class TFXJsonWriter:
+    """writes one json object to FilePath piece by piece.
+    bCompact - no whitespace at all, otherwise every key and every list element starts a new indented line"""
+
+    def __init__(self, FilePath, bCompact=True):
+        self.FilePath = FilePath
+        self.File = open(FilePath, 'w')
+        self.bCompact = bCompact
+        self.ItemSeparator, self.KeySeparator = (',', ':') if bCompact else (', ', ': ')
+        # one entry per open object or list, False until its first item is written
+        self.bHasItems = [False]
+        self.File.write('{')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, ExcType, ExcValue, Traceback):
+        if ExcType is None:
+            self.Close()
+        else:
+            self.Discard()
+
+    def Discard(self):
+        """closes the file without finishing the json and removes the partially written file"""
+        if not self.File.closed:
+            self.File.close()
+        if os.path.exists(self.FilePath):
+            os.remove(self.FilePath)
+
+    def Close(self):
+        if self.File.closed:
+            return
+        self.bHasItems.pop()
+        self.NewLine()
+        self.File.write('}')
+        self.File.close()
+
+    def NewLine(self):
+        if not self.bCompact:
+            self.File.write('\n' + '    ' * len(self.bHasItems))
+
+    def BeginItem(self, Key=None):
+        if self.bHasItems[-1]:
+            self.File.write(',')
+        self.bHasItems[-1] = True
+        self.NewLine()
+        if Key is not None:
+            self.File.write(json.dumps(Key) + self.KeySeparator)
+
+    def ObjectFormat(self, Keys, ValueFormats=FLOAT_FORMAT):
+        """format string of a json object with Keys, ValueFormats - one % format for all values or one per key"""
+        if isinstance(ValueFormats, str):
+            ValueFormats = [ValueFormats] * len(Keys)
+        return '{' + self.ItemSeparator.join(json.dumps(Key) + self.KeySeparator + Format for Key, Format in zip(Keys, ValueFormats)) + '}'
+
+    def ListFormat(self, ElementFormat, Count):
+        """format string of a json list of Count elements"""
+        return '[' + self.ItemSeparator.join([ElementFormat] * Count) + ']'
+
+    def WriteValue(self, Key, Value):
+        """small values only, they are serialized with json.dumps"""
+        self.BeginItem(Key)
+        self.File.write(json.dumps(Value, separators=(self.ItemSeparator, self.KeySeparator)))
+
+    def BeginObject(self, Key):
+        self.BeginItem(Key)
+        self.File.write('{')
+        self.bHasItems.append(False)
+
+    def EndObject(self):
+        self.bHasItems.pop()
+        self.NewLine()
+        self.File.write('}')
+
+    def WriteList(self, Key, Elements):
+        """Elements - iterable of already formatted json strings, one per list element (see FormatRows).
+        an element may also hold several comma separated elements of a flat list"""
+        self.BeginItem(Key)
+        self.File.write('[')
+        self.bHasItems.append(False)
+        Separator = ',' + ('' if self.bCompact else '\n' + '    ' * len(self.bHasItems))
+        Chunk = []
+        for Element in Elements:
+            Chunk.append(Element)
+            if len(Chunk) == CHUNK_SIZE:
+                self.BeginItem()
+                self.File.write(Separator.join(Chunk))
+                Chunk = []
+        if Chunk:
+            self.BeginItem()
+            self.File.write(Separator.join(Chunk))
+        self.EndList()
+
+    def EndList(self):
+        self.bHasItems.pop()
+        self.NewLine()
+        self.File.write(']')
@@ -9,7 +9,6 @@ bl_info = {
     "category": "Animation",
 }
 
-import ctypes
 import random
 import sys
 import os
@@ -17,45 +16,48 @@ import bpy
 import json
 import bmesh
 import mathutils
-from math import sqrt
+import numpy as np
 from bpy_extras.io_utils import ExportHelper
 
 thisdir = os.path.dirname(__file__)
 if not thisdir in sys.path:
     sys.path.append(thisdir )
 
-import Curvesimplifier2 as simp2
+import resample2d
+import TFXJsonWriter
+import TFXBinaryWriter
 
 # Don't change the following maximum joints per vertex value. It must match the one in TressFX loader and simulation
 TRESSFX_MAX_INFLUENTIAL_BONE_COUNT  = 16
 TRESSFX_SIM_THREAD_GROUP_SIZE = 64
 
-class TressFX_Float4(ctypes.Structure):
-	_fields_ = [('x', ctypes.c_float),
-                ('y', ctypes.c_float),
-                ('z', ctypes.c_float),
-                ('w', ctypes.c_float)]
-
-class TressFX_Float2(ctypes.Structure):
-	_fields_ = [('x', ctypes.c_float),
-                ('y', ctypes.c_float)]
-
-class BoneweightmapObj:
-    weight = 0.0
-    boneName= ""
-    sourceVertIndex = -1
-    jointIndex = -1
-    # For sorting 
-    def __lt__(self, other):
-        return self.weight > other.weight
-
-class WeightJointIndexPair:
-	weight = 0
-	joint_index = -1
-
-	# For sorting 
-	def __lt__(self, other):
-		return self.weight > other.weight
+class BoneRegistry:
+    """ordered list of exported bone names, the position in the list is the joint index of the bone"""
+    def __init__(self):
+        self.Names = []
+        self.Indices = {}
+
+    def __len__(self):
+        return len(self.Names)
+
+    def AddBone(self, Name):
+        """returns joint index of the bone, adds it at the end if not registered yet"""
+        JointIndex = self.Indices.get(Name)
+        if JointIndex is None:
+            JointIndex = len(self.Names)
+            self.Indices[Name] = JointIndex
+            self.Names.append(Name)
+        return JointIndex
+
+class RootBindings:
+    """where every strand is attached to the base mesh, one row per strand, all in mesh space"""
+    bFoundIntersection = None   # (N,) bool, False where the root point was used instead of where the strand leaves the mesh
+    Locations = None            # (N, 3) closest point on the mesh
+    FaceIndices = None          # (N,) polygon of the closest point
+    TriVertIndices = None       # (N, 3) first three vertices of the polygon
+    TriLoopIndices = None       # (N, 3) loops of those vertices, for uvs
+    Barycentrics = None         # (N, 3) weights of Locations in the triangle of TriVertIndices
+    ClosestVertIndices = None   # (N,) vertex of the polygon closest to Locations
 
 def GetBonesFromSettings(oMeshObj, ExportBones, eBoneExportMode):
     
@@ -80,6 +82,69 @@ def GetBonesFromSettings(oMeshObj, ExportBones, eBoneExportMode):
                     AllBonesArray.append(bn) # must be ALL_WITH_WEIGHT
     return AllBonesArray
 
+def GetVertexWeightMatrix(MeshObj, Bones, VertIndices=None):
+    """dense (len(VertIndices), len(Bones)) float32 matrix of vertex weights, built by walking the groups of every vertex once.
+    column j is the vertex group of Bones[j], 0 where the vertex is not weighted to it. VertIndices - rows to build, all vertices if None"""
+    GroupToColumn = np.full(len(MeshObj.vertex_groups), -1, dtype=np.intp)
+    for Column, Bone in enumerate(Bones):
+        GroupToColumn[MeshObj.vertex_groups[Bone.name].index] = Column
+
+    Vertices = MeshObj.data.vertices
+    if VertIndices is None:
+        VertIndices = range(len(Vertices))
+    Weights = np.zeros((len(VertIndices), len(Bones)), dtype=np.float32)
+    for Row, VertIndex in enumerate(VertIndices):
+        for Group in Vertices[VertIndex].groups:
+            Column = GroupToColumn[Group.group]
+            if Column >= 0:
+                Weights[Row, Column] = Group.weight
+    return Weights
+
+def GetTopWeights(Weights, Count=TRESSFX_MAX_INFLUENTIAL_BONE_COUNT):
+    """the largest Count weights of every row of the weight matrix, sorted by descending weight, equal weights in column order.
+    returns (Columns (N, Count) int, TopWeights (N, Count)). Columns is -1 where the weight is 0"""
+    NumRows, NumColumns = Weights.shape
+    Rows = np.arange(NumRows)[:, np.newaxis]
+    if NumColumns > Count:
+        Columns = np.argpartition(-Weights, Count - 1, axis=1)[:, :Count]
+    else:
+        Columns = np.tile(np.arange(NumColumns), (NumRows, 1))
+    TopWeights = Weights[Rows, Columns]
+
+    Order = np.lexsort((Columns, -TopWeights), axis=1)
+    Columns = Columns[Rows, Order]
+    TopWeights = TopWeights[Rows, Order]
+
+    # pad so there are always Count entries
+    if NumColumns < Count:
+        Columns = np.hstack((Columns, np.full((NumRows, Count - NumColumns), -1, dtype=Columns.dtype)))
+        TopWeights = np.hstack((TopWeights, np.zeros((NumRows, Count - NumColumns), dtype=TopWeights.dtype)))
+    Columns[TopWeights <= 0] = -1
+    return Columns, TopWeights
+
+def GetSkinningData(MeshObj, Bones, VertIndices=None):
+    """weights of vertices VertIndices (all vertices if None) to Bones.
+    returns (Registry - BoneRegistry of the bones with weights, in order of first use by the vertices,
+             Joints (N, TRESSFX_MAX_INFLUENTIAL_BONE_COUNT) int joint indices into Registry, -1 where the weight is 0,
+             Weights (N, TRESSFX_MAX_INFLUENTIAL_BONE_COUNT) sorted by descending weight)"""
+    if VertIndices is None:
+        BonesWeights = GetVertexWeightMatrix(MeshObj, Bones)
+    else:
+        # vertices can be used more than once, read each of them once
+        UniqueVertIndices, Rows = np.unique(VertIndices, return_inverse=True)
+        BonesWeights = GetVertexWeightMatrix(MeshObj, Bones, UniqueVertIndices.tolist())[Rows]
+    TopColumns, TopWeights = GetTopWeights(BonesWeights)
+
+    # register bones in order of first use, vertex by vertex and in Bones order within a vertex
+    bWeighted = BonesWeights > 0
+    FirstRows = np.where(bWeighted.any(axis=0), bWeighted.argmax(axis=0), len(BonesWeights))
+    Registry = BoneRegistry()
+    ColumnToJoint = np.full(len(Bones) + 1, -1, dtype=np.intp) # last entry maps column -1 to joint -1
+    for Column in np.lexsort((np.arange(len(Bones)), FirstRows)):
+        if FirstRows[Column] < len(BonesWeights):
+            ColumnToJoint[Column] = Registry.AddBone(Bones[Column].name)
+    return Registry, ColumnToJoint[TopColumns], TopWeights
+
 def CurveSpaceVectorToMeshSpace(CurveObj, Vert, MeshObj):
     Point = Vert
     WorldSpace = CurveObj.matrix_world * Point
@@ -90,130 +155,185 @@ def CurveSpaceVectorToMeshSpaceByIndex(CurveObj, CurveVertIndex, MeshObj):
     Point = CurveObj.data.splines[0].points[CurveVertIndex].co
     return CurveSpaceVectorToMeshSpace(CurveObj, Point, MeshObj)
 
-def FindCurveIntersectionWithMesh(CurveObj, MeshObj):
-    """assumes points array goes from root -> tip, returns point in mesh space"""
-
-    CurvePointsAsVectorsArray = [p.co for p in CurveObj.data.splines[0].points]
-
-    #convert the points to same space as the mesh
-    CurvePointsAsVectorsArray = [ CurveSpaceVectorToMeshSpace(CurveObj, p, MeshObj ) for p in CurvePointsAsVectorsArray ]
-    
-    # find the last point on the curve that is inside the mesh
-    # iterate until i find how many points starting from first point are inside
-    # and use direction between the last inside point, and the next point after
-    # if only root point is inside mesh, always just use the second point
-    LastInsideIndex = 0
-    while(
-        IsPointInsideMesh(MeshObj, CurvePointsAsVectorsArray[LastInsideIndex].xyz) 
-        or
-        IsPointInsideMesh2(MeshObj, CurvePointsAsVectorsArray[LastInsideIndex].xyz)
-    ):
-        LastInsideIndex += 1
-    
-    if((LastInsideIndex + 1 ) >= len(CurvePointsAsVectorsArray)):
-        raise Exception('(LastInsideIndex + 1 ) == len(CurvePointsAsVectorsArray). This should never happen.')
-
-    Direction = (CurvePointsAsVectorsArray[LastInsideIndex + 1] - CurvePointsAsVectorsArray[LastInsideIndex]).normalized()
-
-    for Face in MeshObj.data.polygons:
-
-        Origin = CurvePointsAsVectorsArray[0]
-        VerticesIndices = Face.vertices
-        p1, p2, p3 = [MeshObj.data.vertices[VerticesIndices[i]].co for i in range(3)]
-
-        # last arg is clip to area of triangle, obviously we want that
-        found = mathutils.geometry.intersect_ray_tri(p1, p2, p3, Direction, Origin, True)
-        if found is not None:
-            return found
-    return None
-
-def GetNumPointsInsideMesh(MeshObj, CurveObj):
-    
-    num = 0
-    for p in CurveObj.data.splines[0].points:
-        InMeshSpace = CurveSpaceVectorToMeshSpace(CurveObj, p.co, MeshObj)
-        inside1 = IsPointInsideMesh(MeshObj, InMeshSpace.xyz )
-        inside2 = IsPointInsideMesh2(MeshObj, InMeshSpace.xyz  )
-        if inside1 or inside2:
-            num = num + 1
-    return num
-
-def IsPointInsideMesh(MeshObj, PointInObjectSpace):      
-    """point must already be in object space"""
+def GetCurvesPointsPacked(CurveObjs):
+    """reads splines[0] points of every curve once with foreach_get.
+    returns packed (points (M, 4) float32, offsets (N+1,)), curve i is points[offsets[i]:offsets[i+1]]"""
+    Counts = [len(CurveObj.data.splines[0].points) for CurveObj in CurveObjs]
+    Offsets = np.zeros(len(Counts) + 1, dtype=np.intp)
+    np.cumsum(Counts, out=Offsets[1:])
+    Points = np.empty((Offsets[-1], 4), dtype=np.float32)
+    for CurveObj, Start, End in zip(CurveObjs, Offsets[:-1], Offsets[1:]):
+        CurveObj.data.splines[0].points.foreach_get('co', Points[Start:End].ravel())
+    return Points, Offsets
+
+def GetCurveSplinesPointsPacked(CurveObj):
+    """reads points of all splines of a single curve with foreach_get.
+    returns packed (points (M, 4) float32, offsets (N+1,)), spline i is points[offsets[i]:offsets[i+1]]"""
+    Splines = CurveObj.data.splines
+    Counts = [len(Spline.points) for Spline in Splines]
+    Offsets = np.zeros(len(Counts) + 1, dtype=np.intp)
+    np.cumsum(Counts, out=Offsets[1:])
+    Points = np.empty((Offsets[-1], 4), dtype=np.float32)
+    for Spline, Start, End in zip(Splines, Offsets[:-1], Offsets[1:]):
+        Spline.points.foreach_get('co', Points[Start:End].ravel())
+    return Points, Offsets
+
+def GetParticleHairPointsPacked(ParticleSystem):
+    """reads hair keys of every particle with foreach_get, in the emitter object space. child hairs are not included.
+    returns packed (points (M, 3) float32, offsets (N+1,)), hair i is points[offsets[i]:offsets[i+1]]"""
+    Particles = ParticleSystem.particles
+    Counts = [len(Particle.hair_keys) for Particle in Particles]
+    Offsets = np.zeros(len(Counts) + 1, dtype=np.intp)
+    np.cumsum(Counts, out=Offsets[1:])
+    Points = np.empty((Offsets[-1], 3), dtype=np.float32)
+    for Particle, Start, End in zip(Particles, Offsets[:-1], Offsets[1:]):
+        Particle.hair_keys.foreach_get('co', Points[Start:End].ravel())
+    return Points, Offsets
+
+def CurvesPointsToSpace(CurvesPoints, CurveObjs, MeshObj=None):
+    """(N, P, 4) curve space points -> world space, or mesh space if MeshObj is given"""
+    Matrices = np.array([np.array(CurveObj.matrix_world) for CurveObj in CurveObjs])
+    if MeshObj is not None:
+        Matrices = np.matmul(np.array(MeshObj.matrix_world.inverted()), Matrices)
+    return np.einsum('nij,npj->npi', Matrices, CurvesPoints)
+
+def FindStrandsIntersectionWithMesh(BVH, StrandsPoints, PointsInside):
+    """finds where every strand leaves the mesh, against a prebuilt BVH tree of the mesh.
+    StrandsPoints - (N, P, 3 or 4) points in mesh space, every strand goes from root -> tip.
+    PointsInside - (N, P) bool, True for points inside the mesh, as returned by GetStrandsMostlyInsideMesh.
+    returns (Intersections (N, 3) in mesh space, bFound (N,) bool). where no intersection is found the root point is used instead"""
+
+    Intersections = np.array(StrandsPoints[:, 0, :3], dtype=np.float64)
+    bFound = np.zeros(len(StrandsPoints), dtype=bool)
+    NumPoints = StrandsPoints.shape[1]
+
+    # number of points starting from the root that are inside the mesh, the first point outside of it for every strand.
+    # the ray goes along the segment that starts there, if only root point is inside mesh that is from the second point
+    FirstOutside = np.argmax(~PointsInside, axis=1)
+    # strands that never leave the mesh, or only with the tip, have no segment to cast along and keep the root point
+    bHasSegment = (~PointsInside).any(axis=1) & (FirstOutside + 1 < NumPoints)
+    RayStrands = np.flatnonzero(bHasSegment)
+    Segments = (StrandsPoints[RayStrands, FirstOutside[RayStrands] + 1, :3] - StrandsPoints[RayStrands, FirstOutside[RayStrands], :3])
+    Directions = Segments / np.linalg.norm(Segments, axis=1)[:, np.newaxis]
+
+    # nearest hit along the ray from the root
+    for idx, Direction in zip(RayStrands.tolist(), Directions.tolist()):
+        Location, Normal, Index, Distance = BVH.ray_cast(mathutils.Vector(Intersections[idx]), mathutils.Vector(Direction))
+        if Location is not None:
+            Intersections[idx] = Location
+            bFound[idx] = True
+
+    return Intersections, bFound
+
+def GetBarycentricCoordinates(Points, A, B, C):
+    """(N, 3) barycentric weights of Points in triangles A, B, C (all (N, 3)), after projecting onto the triangle plane.
+    same weights mathutils.geometry.barycentric_transform uses, can be negative outside the triangle"""
+    v0 = B - A
+    v1 = C - A
+    v2 = Points - A
+    d00 = np.einsum('ij,ij->i', v0, v0)
+    d01 = np.einsum('ij,ij->i', v0, v1)
+    d11 = np.einsum('ij,ij->i', v1, v1)
+    d20 = np.einsum('ij,ij->i', v2, v0)
+    d21 = np.einsum('ij,ij->i', v2, v1)
+    Denom = d00 * d11 - d01 * d01
+    Weights = np.full((len(Points), 3), 1.0 / 3.0) # degenerate triangles
+    Valid = Denom != 0
+    Weights[Valid, 1] = (d11 * d20 - d01 * d21)[Valid] / Denom[Valid]
+    Weights[Valid, 2] = (d00 * d21 - d01 * d20)[Valid] / Denom[Valid]
+    Weights[Valid, 0] = 1.0 - Weights[Valid, 1] - Weights[Valid, 2]
+    return Weights
+
+def BindStrandRoots(MeshObj, BVH, StrandsPoints, PointsInside):
+    """finds once for every strand where it is attached to the mesh. StrandsPoints - (N, P, 3 or 4) in mesh space, root -> tip.
+    PointsInside - (N, P) bool inside mask of the points. returns RootBindings"""
+    Bindings = RootBindings()
+    Intersections, Bindings.bFoundIntersection = FindStrandsIntersectionWithMesh(BVH, StrandsPoints, PointsInside)
+
+    #get closest point on base mesh
+    Bindings.Locations = np.empty((len(Intersections), 3))
+    Bindings.FaceIndices = np.empty(len(Intersections), dtype=np.intp)
+    for idx, IntersectionPoint in enumerate(Intersections.tolist()):
+        Location, Normal, FaceIndex, Distance = BVH.find_nearest(mathutils.Vector(IntersectionPoint))
+        Bindings.Locations[idx] = Location
+        Bindings.FaceIndices[idx] = FaceIndex
+
+    Mesh = MeshObj.data
+    VertCo = np.empty((len(Mesh.vertices), 3), dtype=np.float32)
+    Mesh.vertices.foreach_get('co', VertCo.ravel())
+    LoopVerts = np.empty(len(Mesh.loops), dtype=np.int32)
+    Mesh.loops.foreach_get('vertex_index', LoopVerts)
+    LoopStart = np.empty(len(Mesh.polygons), dtype=np.int32)
+    Mesh.polygons.foreach_get('loop_start', LoopStart)
+    LoopTotal = np.empty(len(Mesh.polygons), dtype=np.int32)
+    Mesh.polygons.foreach_get('loop_total', LoopTotal)
+    LoopStart = LoopStart[Bindings.FaceIndices]
+    LoopTotal = LoopTotal[Bindings.FaceIndices]
+
+    # the first three vertices of the polygon are used as its triangle
+    Bindings.TriLoopIndices = LoopStart[:, np.newaxis] + np.arange(3)
+    Bindings.TriVertIndices = LoopVerts[Bindings.TriLoopIndices]
+    A, B, C = VertCo[Bindings.TriVertIndices].transpose(1, 0, 2)
+    Bindings.Barycentrics = GetBarycentricCoordinates(Bindings.Locations, A, B, C)
+
+    # find closest vertex to location, out of all vertices of the polygon
+    Corners = np.arange(LoopTotal.max())
+    Valid = Corners < LoopTotal[:, np.newaxis]
+    PolyVerts = LoopVerts[np.where(Valid, LoopStart[:, np.newaxis] + Corners, LoopStart[:, np.newaxis])]
+    Distances = np.linalg.norm(VertCo[PolyVerts] - Bindings.Locations[:, np.newaxis], axis=2)
+    Distances[~Valid] = np.inf
+    Bindings.ClosestVertIndices = PolyVerts[np.arange(len(PolyVerts)), np.argmin(Distances, axis=1)]
+    return Bindings
+
+def GetMeshBVHTree(MeshObj):
+    """BVH tree of the evaluated mesh in object space. build it once per export and reuse it for all queries"""
+    return mathutils.bvhtree.BVHTree.FromObject(MeshObj, bpy.context.scene)
+
+def IsPointInsideMeshBVH(BVH, PointInObjectSpace):
+    """True if the point is inside the mesh of the prebuilt BVH tree. point must already be in object space.
+    inside means an odd number of crossings along a ray, or the nearest face pointing away from the point"""
     #direction is irellevant unless mesh is REALLY wierd shaped
-    direction = mathutils.Vector((1,0,0))  
-    epsilon = direction * 1e-6  
-    count = 0  
-    result, PointInObjectSpace, normal, index = MeshObj.ray_cast(PointInObjectSpace, direction)  
-    while result:  
-        count += 1  
-        result, PointInObjectSpace, normal, index = MeshObj.ray_cast(PointInObjectSpace + epsilon, direction)  
-    return (count % 2) == 1  
-
-#this assumes all faces of the object are pointing outwards
-def IsPointInsideMesh2(obj, p, max_dist = 1.84467e+19):
-    """this assumes all faces of the object are pointing outwards. 
-    the test point is already in object space so fix ur shit"""
-    bResult, point, normal, face = obj.closest_point_on_mesh(p, max_dist)
-    p2 = point-p
-    v = p2.dot(normal)
-    return not(v < 0.0)
-
-def VecDistance(vec1, vec2):
-    return sqrt((vec1.x - vec2.x)**2 + (vec1.y - vec2.y)**2 + (vec1.z - vec2.z)**2)
-
-def FindIndexOfClosestVector(Point, VecList):
-    closest = VecList[0]
-    index = 0
-    for i in range (0, len(VecList)):
-        if VecDistance(VecList[i], Point) < VecDistance(Point, closest):
-            closest = VecList[i]
-            index = i
-    return index
-
-def FindIndexOfClosestPointOnMesh(vert, Obj):
-    objVerts = [v.co for v in Obj.data.vertices]
-    index = FindIndexOfClosestVector(vert,objVerts)
-    return index
-
-def RecursiveSubdivideCurveIfNeeded(context, CurveObj, nDesiredVertNum):
-    """takes in a curve and subdivides it until it has numpoints >= nDesiredVertNum"""
-    bpy.ops.object.mode_set(mode='OBJECT')
-    bpy.context.scene.objects.active = CurveObj
-
-    CurvePoints = [(vert.x, vert.y, vert.z) for vert in [p.co for p in CurveObj.data.splines[0].points]]
-    
-    if len(CurvePoints) < nDesiredVertNum:
-        bpy.ops.object.mode_set(mode='EDIT')
-        bpy.ops.curve.select_all(action = 'SELECT')
-        bpy.ops.curve.subdivide()
-        return RecursiveSubdivideCurveIfNeeded(context, CurveObj, nDesiredVertNum)
-    else:
-        bpy.ops.object.mode_set(mode='OBJECT')
-        return CurveObj
-
-def CreateNewCurveFromPoints(StrandVerts, CurveName):
-    """strandverts need to be array of mathutils.Vector"""
-    curveData = bpy.data.curves.new(CurveName, type='CURVE')
-    curveData.dimensions = '3D'
-    curveData.resolution_u = 12
-    polyline = curveData.splines.new('POLY')
-    polyline.points.add(len(StrandVerts) - 1) # theres already one point by default
-    
-    for i, vert in enumerate(StrandVerts):
-        polyline.points[i].co = (vert.x, vert.y, vert.z, 1)
-
-    # create Object
-    curveOB = bpy.data.objects.new(CurveName, curveData)
-    
-    # attach to scene and validate context
-    bpy.context.scene.objects.link(curveOB)
-    bpy.context.scene.objects.active = curveOB
-    curveOB.select = True
-    return curveOB
+    direction = mathutils.Vector((1,0,0))
+    epsilon = direction * 1e-6
+    count = 0
+    Location, Normal, Index, Distance = BVH.ray_cast(PointInObjectSpace, direction)
+    while Location is not None:
+        count += 1
+        Location, Normal, Index, Distance = BVH.ray_cast(Location + epsilon, direction)
+    if (count % 2) == 1:
+        return True
+
+    #this assumes all faces of the object are pointing outwards
+    Location, Normal, Index, Distance = BVH.find_nearest(PointInObjectSpace)
+    if Location is None:
+        return False
+    return not((Location - PointInObjectSpace).dot(Normal) < 0.0)
+
+def GetStrandsMostlyInsideMesh(BVH, StrandsPoints, MaxNumInside):
+    """StrandsPoints - (N, P, 3 or 4) points in mesh space.
+    returns (MostlyInside (N,) bool, True where more than MaxNumInside points of the strand are inside the mesh,
+             PointsInside (N, P) bool, True for the points found inside the mesh).
+    testing the points of a strand stops as soon as its outcome is known, untested points are False in PointsInside.
+    for strands that are not mostly inside, testing only stops at a point outside, so their first point outside is always in PointsInside"""
+    NumPoints = StrandsPoints.shape[1]
+    MostlyInside = np.zeros(len(StrandsPoints), dtype=bool)
+    PointsInside = np.zeros(StrandsPoints.shape[:2], dtype=bool)
+    for idx, StrandPoints in enumerate(StrandsPoints.tolist()):
+        NumInside = 0
+        for PtIdx, p in enumerate(StrandPoints):
+            if IsPointInsideMeshBVH(BVH, mathutils.Vector(p[:3])):
+                PointsInside[idx, PtIdx] = True
+                NumInside += 1
+                if NumInside > MaxNumInside:
+                    MostlyInside[idx] = True
+                    break
+            elif NumInside + (NumPoints - PtIdx - 1) <= MaxNumInside:
+                # even if all remaining points are inside it stays below the cutoff
+                break
+    return MostlyInside, PointsInside
 
 def SeparateCurves(context):
-    """dont use this it crashes on huge numbers of cursves. use SeparateCurves2.
+    """dont use this it crashes on huge numbers of cursves.
         Im keeping this here so i dont forget
     """
     active = context.active_object
@@ -232,27 +352,6 @@ def SeparateCurves(context):
 
     bpy.ops.object.mode_set(mode='OBJECT')
 
-def SeparateCurves2(context):
-    """this is much faster than using the other separatecurves function"""
-    Curves = []
-    active = context.active_object
-    splines = active.data.splines
-
-    for idx, spline in enumerate(splines):        
-
-        CurveName = active.name + "_" + str(idx)
-        StrandVerts = [v.co for v in spline.points]
-        # create Object
-        curveOB = CreateNewCurveFromPoints(StrandVerts, CurveName)
-        Curves.append(curveOB)
-
-    #delete original curve that had all the curves in one object
-    bpy.ops.object.select_all(action='DESELECT')
-    bpy.data.objects[active.name].select = True
-    bpy.ops.object.delete()
-
-    return Curves
-
 def OnBoneSelect(self, context):
     #NOTE: self is FTressFXProps instance
     boneName = self.dummyBoneStr
@@ -495,6 +594,19 @@ class FTressFXProps(bpy.types.PropertyGroup):
             default=True
             )
 
+        FTressFXProps.eOutputFormat = bpy.props.EnumProperty(
+            name='Output Format',
+            description='TFXJSON: .tfxjson text file. TFX_BINARY: binary .tfx and .tfxbone files, much smaller and faster to load. BOTH: all of them',
+            items=[('TFXJSON', 'TFXJSON', 'TFXJSON'),('TFX_BINARY', 'TFX_BINARY', 'TFX_BINARY'),('BOTH', 'BOTH', 'BOTH')],
+            default = 'TFXJSON'
+            )
+
+        FTressFXProps.bCompactJson = bpy.props.BoolProperty(
+            name="Compact tfxjson", 
+            description="Writes the tfxjson file without any whitespace, files get much smaller",
+            default=True
+            )
+
         FTressFXProps.sOutputDir = bpy.props.StringProperty(
             name="Export Directory", 
             description="The export directory",
@@ -621,6 +733,22 @@ class FTressFXPanel(bpy.types.Panel):
             RightCol = RandomizeStrandsSplit.column()
             RightCol.prop(oTFXProps, "bRandomizeStrandsForLOD", text="")
 
+            #output format
+            OutputFormatRow = MainBox.row()
+            OutputFormatSplit = OutputFormatRow.split(percentage=0.5)
+            LeftCol = OutputFormatSplit.column()
+            LeftCol.label(text="Output Format:")
+            RightCol = OutputFormatSplit.column()
+            RightCol.prop(oTFXProps, "eOutputFormat", text="")
+
+            #compact json
+            CompactJsonRow = MainBox.row()
+            CompactJsonSplit = CompactJsonRow.split(percentage=0.5)
+            LeftCol = CompactJsonSplit.column()
+            LeftCol.label(text="Compact tfxjson:")
+            RightCol = CompactJsonSplit.column()
+            RightCol.prop(oTFXProps, "bCompactJson", text="")
+
             #export type, particle system or selected curves
             ExportTypeRow = MainBox.row()
             ExportTypeSplit = ExportTypeRow.split(percentage=0.5)
@@ -733,74 +861,41 @@ class FTressFXCollisionExport(bpy.types.Operator):
     def SaveTfxMeshTextFile(self, context):
 
         AllBonesArray = GetBonesFromSettings(self.oColMesh, self.ExportBones, self.eBoneExportMode)
-        BonesArray_WithWeightsOnly = []
 
         NumVerts = len(self.oColMesh.data.vertices)
         
-        # each entry is as array of 4 BoneweightmapObj's
-        VertWeightData = []
-        for idx, Vert in enumerate(self.oColMesh.data.vertices):
-
-            #get weights
-            VertWeights = []
-
-            for Bone in AllBonesArray:
-                weight = -1
-                
-                try:
-                    weight = self.oColMesh.vertex_groups[Bone.name].weight(Vert.index)                    
-                except:
-                    if self.bDebugMode:
-                        print('vertex index ' + str(Vert.index) + ' is not weighted to ' + Bone.name )
-                    pass
-
-                if weight > 0 :
-                    boneweightmapObj = BoneweightmapObj()
-                    boneweightmapObj.boneName = Bone.name
-                    boneweightmapObj.weight = weight
-                    boneweightmapObj.sourceVertIndex = Vert.index
-                    VertWeights.append( boneweightmapObj )
-                    if Bone.name not in BonesArray_WithWeightsOnly:
-                        BonesArray_WithWeightsOnly.append(Bone.name)
-            
-            VertWeights.sort()
+        # weights of every vertex, read once
+        BonesRegistry, VertJoints, VertWeights = GetSkinningData(self.oColMesh, AllBonesArray)
 
-            if len(VertWeights) < 1:
-                self.report({'ERROR'}, "No weights found for at least one vertex! Make sure to whitelist or blacklist bones! Or use all with weight.")
-                return 'ERROR'
-            
-            #make sure we have at least 4
-            while len(VertWeights) < TRESSFX_MAX_INFLUENTIAL_BONE_COUNT :
-                VertWeights.append(BoneweightmapObj())
+        if NumVerts > 0 and (VertJoints[:, 0] < 0).any():
+            self.report({'ERROR'}, "No weights found for at least one vertex! Make sure to whitelist or blacklist bones! Or use all with weight.")
+            return 'ERROR'
 
-            VertWeightData.append(VertWeights)
+        # joints without weight are written as 0
+        VertJoints = np.maximum(VertJoints, 0)
 
         OutFilePath = self.sOutputDir + (self.sOutputName if len(self.sOutputName) > 0 else self.oColMesh.name)  + ".tfxmesh"
         print(OutFilePath)
         TFXMeshFile = open(OutFilePath, "w")
         TFXMeshFile.write("# TressFX collision mesh exported by TressFX Exporter for Blender. Written by Jacob Kostenick\n")
-        TFXMeshFile.write("numOfBones %g\n" % (len(BonesArray_WithWeightsOnly)))
+        TFXMeshFile.write("numOfBones %g\n" % (len(BonesRegistry)))
 
         TFXMeshFile.write("# bone index, bone name\n")
-        for i in range(len(BonesArray_WithWeightsOnly)):
-            TFXMeshFile.write("%d %s\n" % (i, BonesArray_WithWeightsOnly[i]))
+        for i, BoneName in enumerate(BonesRegistry.Names):
+            TFXMeshFile.write("%d %s\n" % (i, BoneName))
 
 	    # write vertex positions and skinning data
         TFXMeshFile.write("numOfVertices %g\n" % (NumVerts))
         TFXMeshFile.write("# vertex index, vertex position x, y, z, normal x, y, z, joint index 0, joint index 1, joint index 2, joint index 3, weight 0, weight 1, weight 2, weight 3\n")
         for idx, Vert in enumerate(self.oColMesh.data.vertices):
-            Weights = VertWeightData[idx]
-            for W in Weights:
-                if W.weight <= 0:
-                    W.jointIndex = 0
-                else:
-                    W.jointIndex = BonesArray_WithWeightsOnly.index(W.boneName)
+            Joints = VertJoints[idx].tolist()
+            Weights = VertWeights[idx].tolist()
             
             Normal = Vert.normal
             Pos = Vert.co
             VertIndex = Vert.index
-            TFXMeshFile.write("%g %g %g %g %g %g %g %g %g %g %g %g %g %g %g\n" % (VertIndex, Pos.x, Pos.y, Pos.z, Normal.x, Normal.y, Normal.z, Weights[0].jointIndex, Weights[1].jointIndex, Weights[2].jointIndex, Weights[3].jointIndex,
-                                                            Weights[0].weight, Weights[1].weight, Weights[2].weight, Weights[3].weight))
+            TFXMeshFile.write("%g %g %g %g %g %g %g %g %g %g %g %g %g %g %g\n" % (VertIndex, Pos.x, Pos.y, Pos.z, Normal.x, Normal.y, Normal.z, Joints[0], Joints[1], Joints[2], Joints[3],
+                                                            Weights[0], Weights[1], Weights[2], Weights[3]))
         
         TFXMeshFile.write("numOfTriangles %g\n" % (len(self.oColMesh.data.polygons)))    
         TFXMeshFile.write("# triangle index, vertex index 0, vertex index 1, vertex index 2\n")
@@ -884,277 +979,234 @@ class FTressFXExport(bpy.types.Operator):
     def poll(cls, context):
         return context.active_object is not None
 
-    def GetCurveLength(self, context, curveObj):
-
-        curvePoints = [p.co for p in curveObj.data.splines[0].points]
-        length = 0
-
-        for x in range( (len(curvePoints) - 1)):
-            vert0 = curvePoints[x]
-            vert1 = curvePoints[x + 1]
-            length += (vert0-vert1).length
-        return length
-
-    def SaveTFXHairJsonFile(self, context, lHairs):
+    def GetStrandIndicesToUse(self, Points, Offsets):
+        """accounts for min curve length and LOD shuffling on packed strands.
+        returns indices of the strands to export, in export order"""
 
-        curvesToUse = []
+        StrandIndices = []
 
         # account for minnum curve length
-        checkForMinCurveLength = bool(self.fMinCurvelength > 0)
+        if self.fMinCurvelength > 0:
 
-        if checkForMinCurveLength:
-
-            for idx, curve in enumerate(lHairs):
-                CurveLength = self.GetCurveLength(context, curve)
+            CurveLengths = resample2d.get_strand_lengths_packed(Points[:, :3], Offsets)
+            for idx, CurveLength in enumerate(CurveLengths):
                 CurveLength_lengthFormatted = '{:.6f}'.format(CurveLength)
                 if CurveLength >= self.fMinCurvelength:
-                    curvesToUse.append(curve)
+                    StrandIndices.append(idx)
                     print('curve idx ' + str(idx) + ' length: ' + CurveLength_lengthFormatted)
                 else:
                     print('dicarding curve with index ' + str(idx) + ' length: ' + CurveLength_lengthFormatted) 
         else:
-            curvesToUse = lHairs
+            StrandIndices = list(range(len(Offsets) - 1))
+
+        # a single point can't be resampled into a strand
+        Counts = np.diff(Offsets)
+        for idx in np.flatnonzero(Counts < 2):
+            print('dicarding curve with index ' + str(idx) + ', it has less than 2 points')
+        StrandIndices = [idx for idx in StrandIndices if Counts[idx] >= 2]
 
         if self.bRandomizeStrandsForLOD and not self.bDebugMode:
-            random.shuffle(curvesToUse)
+            random.shuffle(StrandIndices)
 
-        FinalCurves = []
-        # num verts per strand is always even so this is fine
-        CutoffPoint = int(self.nNumVertsPerStrand / 2)
+        return StrandIndices
 
-        TotalNumInside = 0
-        
-        #make curves compatible with TressFX
-        for idx, CurveObj in enumerate(curvesToUse):
+    def GetStrandsWithNumVerts(self, Points, Offsets):
+        """makes packed strands compatible with TressFX, all in memory.
+        returns (N, nNumVertsPerStrand, 4) array of strand points in the same space, w = 1"""
 
-            #we need to subdivide the curve if it has less points than self.nNumVertsPerStrand
-            CorrectCurve = RecursiveSubdivideCurveIfNeeded(context, CurveObj, self.nNumVertsPerStrand)
-            NewCurve = None
-            #now resample to exactly nNumVertsPerStrand if needed
-            if len(CorrectCurve.data.splines[0].points) != self.nNumVertsPerStrand:
+        #we need to subdivide the strands that have less points than self.nNumVertsPerStrand
+        Points, Offsets = resample2d.subdivide_strands_packed(Points, Offsets, self.nNumVertsPerStrand)
 
-                if self.bDebugMode:
-                    print('strand index ' + str(idx) + ' has ' + str(len(CorrectCurve.data.splines[0].points)) + ' points. Simplifying to ' + str(self.nNumVertsPerStrand) )
-                
-                #modify curve so it has exactly the right number of points
-                NewCurve = simp2.SimplifyCurve(context, CorrectCurve, self.nNumVertsPerStrand)
-            else:
-                NewCurve = CorrectCurve
+        #now resample to exactly nNumVertsPerStrand if needed, strands that already have the right number of points are kept as they are
+        Counts = np.diff(Offsets)
+        StrandsPoints = np.ones((len(Counts), self.nNumVertsPerStrand, 4))
+        KeepIndices = np.flatnonzero(Counts == self.nNumVertsPerStrand)
+        ResampleIndices = np.flatnonzero(Counts != self.nNumVertsPerStrand)
 
-            if len(NewCurve.data.splines[0].points) != self.nNumVertsPerStrand:
-                raise Exception('len(NewCurve.data.splines[0].points) != self.nNumVertsPerStrand')
+        KeepPoints, _ = resample2d.take_strands_packed(Points, Offsets, KeepIndices)
+        StrandsPoints[KeepIndices, :, :3] = KeepPoints.reshape(-1, self.nNumVertsPerStrand, 3)
 
-            #check to see if more than half the points are inside the mesh, if so, discard that strand
-            NumInside = GetNumPointsInsideMesh(self.oBaseMesh, NewCurve)
+        if len(ResampleIndices):
+            if self.bDebugMode:
+                for idx in ResampleIndices:
+                    print('strand index ' + str(idx) + ' has ' + str(Counts[idx]) + ' points. Simplifying to ' + str(self.nNumVertsPerStrand) )
+            ResamplePoints, ResampleOffsets = resample2d.take_strands_packed(Points, Offsets, ResampleIndices)
+            ResampledPoints, _ = resample2d.interpol_Catmull_Rom_packed(ResamplePoints, ResampleOffsets, self.nNumVertsPerStrand, uniform_spacing=True)
+            StrandsPoints[ResampleIndices, :, :3] = ResampledPoints.reshape(-1, self.nNumVertsPerStrand, 3)
 
-            if NumInside > CutoffPoint:
-                TotalNumInside = TotalNumInside + 1
-                if self.bDebugMode:
-                    print('discarding strand with index: ' + str(idx) + '. More than half of the vertices are inside the base mesh.')
-                continue
-            else:
-                FinalCurves.append(NewCurve)
-        #enumerate(curvesToUse): end
+        return StrandsPoints
+
+    def SaveTFXHairFiles(self, context, lHairs):
+        """lHairs - curve objects, only read. the curves themselves are not modified"""
+
+        Points, Offsets = GetCurvesPointsPacked(lHairs)
+        StrandIndices = self.GetStrandIndicesToUse(Points, Offsets)
+        curvesToUse = [lHairs[idx] for idx in StrandIndices]
+        Points, Offsets = resample2d.take_strands_packed(Points[:, :3], Offsets, StrandIndices)
+
+        CurvesPoints = self.GetStrandsWithNumVerts(Points, Offsets)
+        CurvesPointsMeshSpace = CurvesPointsToSpace(CurvesPoints, curvesToUse, self.oBaseMesh)
+
+        return self.SaveTFXStrandsFiles(context, CurvesPointsMeshSpace, [CurveObj.name for CurveObj in curvesToUse])
+
+    def SaveTFXParticleHairFiles(self, context, Points, Offsets, StrandNames):
+        """Points, Offsets - packed (M, 3) hair points in base mesh space. no scene objects are created"""
+
+        StrandIndices = self.GetStrandIndicesToUse(Points, Offsets)
+        Points, Offsets = resample2d.take_strands_packed(Points, Offsets, StrandIndices)
+        StrandNames = [StrandNames[idx] for idx in StrandIndices]
+
+        StrandsPoints = self.GetStrandsWithNumVerts(Points, Offsets)
+
+        return self.SaveTFXStrandsFiles(context, StrandsPoints, StrandNames)
+
+    def SaveTFXStrandsFiles(self, context, StrandsPointsMeshSpace, StrandNames):
+        """StrandsPointsMeshSpace - (N, nNumVertsPerStrand, 4) points in base mesh space, StrandNames - name of every strand for debugging"""
+
+        # num verts per strand is always even so this is fine
+        CutoffPoint = int(self.nNumVertsPerStrand / 2)
+
+        #check to see if more than half the points are inside the mesh, if so, discard that strand
+        self.BaseMeshBVH = GetMeshBVHTree(self.oBaseMesh)
+        MostlyInside, PointsInside = GetStrandsMostlyInsideMesh(self.BaseMeshBVH, StrandsPointsMeshSpace, CutoffPoint)
+        TotalNumInside = int(np.count_nonzero(MostlyInside))
+        FinalIndices = np.flatnonzero(~MostlyInside)
+
+        if self.bDebugMode:
+            for idx in np.flatnonzero(MostlyInside):
+                print('discarding strand with index: ' + str(idx) + '. More than half of the vertices are inside the base mesh.')
 
-        nNumCurves = len(FinalCurves)
+        FinalNames = [StrandNames[idx] for idx in FinalIndices]
+        FinalPointsMeshSpace = StrandsPointsMeshSpace[FinalIndices]
+        FinalPointsWorldSpace = np.einsum('ij,npj->npi', np.array(self.oBaseMesh.matrix_world), FinalPointsMeshSpace)
+
+        nNumCurves = len(FinalNames)
 
         if nNumCurves < TRESSFX_SIM_THREAD_GROUP_SIZE:
-            if checkForMinCurveLength:
+            if self.fMinCurvelength > 0:
                 self.report({'ERROR'}, "Not enough curves found after accounting for Min Curve Length! At least " + str(TRESSFX_SIM_THREAD_GROUP_SIZE) + " curves are required!")
             else:
                 self.report({'ERROR'}, "Not enough curves found! At least " + str(TRESSFX_SIM_THREAD_GROUP_SIZE) + " curves are required!")
             return 'ERROR'
         
-        OutFilePath = self.sOutputDir + (self.sOutputName if len(self.sOutputName) > 0 else self.oBaseMesh.name)  + ".tfxjson"
-        print(OutFilePath)
+        OutFilePath = self.sOutputDir + (self.sOutputName if len(self.sOutputName) > 0 else self.oBaseMesh.name)
 
-        FinalObj = {}
-        FinalObj['positions'] = []
-        FinalObj['uvs'] = []
-        FinalObj['numHairStrands'] = nNumCurves
-        FinalObj['numVerticesPerStrand'] = self.nNumVertsPerStrand
-        if self.bDebugMode:
-            FinalObj['totalNumInside'] = TotalNumInside
+        Positions = self.GetTFXPositions(FinalPointsWorldSpace)
 
-        for nHairIdx, CurveObj in enumerate(FinalCurves):            
-            
-            CurvePoints = [p.co for p in CurveObj.data.splines[0].points]
-            #make sure they are in WS
-            CurvePoints = [ CurveObj.matrix_world * p for p in CurvePoints ]
-            # now we ready to write the points
-            strandVerts = []
-            for PtIdx, Point in enumerate(CurvePoints):
-
-                p = TressFX_Float4()
-                p.x = Point[0]
-
-                if self.bInvertZAxis:
-                    p.z = -Point[2] # flip in z-axis
-                else:
-                    p.z = Point[2]
-                    
-                if self.bInvertYAxisUV:
-                    p.y = -Point[1]
-                else:
-                    p.y = Point[1]
+        # where the strands are attached to the base mesh, shared by the uv and the weights pass
+        Bindings = BindStrandRoots(self.oBaseMesh, self.BaseMeshBVH, FinalPointsMeshSpace, PointsInside[FinalIndices])
 
-                # w component is an inverse mass
-                if PtIdx == 0 or PtIdx == 1: # the first two vertices are immovable always. 
-                    p.w = 0
-                else:
-                    p.w = 1.0
-                vert = {}
-                vert['x'] = p.x
-                vert['y'] = p.y
-                vert['z'] = p.z
-                vert['w'] = p.w
-                strandVerts.append(vert)
-            # enumerate(CurvePoints):
-            FinalObj['positions'].append(strandVerts)
-        # enumerate(FinalCurves) END
-        
-        # get strand texture coords
-        for strandIndex, CurveObj in enumerate(FinalCurves):
-            
-            Points = [p.co for p in CurveObj.data.splines[0].points]
-            
-            rootPoint = Points[0]
-            IntersectionPoint = FindCurveIntersectionWithMesh(CurveObj, self.oBaseMesh)            
-
-            if IntersectionPoint is None:
-                if self.bDebugMode:
-                    print('no intersection point found for strandIndex: ' + str(strandIndex) + ' using rootpoint instead to find uvs')
-                IntersectionPoint = CurveSpaceVectorToMeshSpace(CurveObj, rootPoint, self.oBaseMesh)
+        if self.bDebugMode:
+            for strandIndex in np.flatnonzero(~Bindings.bFoundIntersection):
+                print('no intersection point found for strandIndex: ' + str(strandIndex) + ' using rootpoint instead to find uvs')
 
-            pVector = mathutils.Vector((IntersectionPoint[0],IntersectionPoint[1],IntersectionPoint[2]))
+        UVs = self.GetTFXUVs(Bindings)
 
-            #get closest point on base mesh
-            bResult, Location, Normal, FaceIndex = self.oBaseMesh.closest_point_on_mesh(pVector)
-            
-            #calculate uv at that point on the mesh
-            # https://blender.stackexchange.com/questions/79236/access-color-of-a-point-given-the-3d-position-on-the-surface-of-a-polygon
-            VerticesIndices = self.oBaseMesh.data.polygons[FaceIndex].vertices
-            p1, p2, p3 = [self.oBaseMesh.data.vertices[VerticesIndices[i]].co for i in range(3)]
-            UVMapIndices = self.oBaseMesh.data.polygons[FaceIndex].loop_indices
-            # always assume the active layer is the one to use
-            ActiveUVMap = self.oBaseMesh.data.uv_layers.active
-            UV1, UV2, UV3 = [ActiveUVMap.data[UVMapIndices[i]].uv for i in range(3)]
-            
-            #make them 3d so we can use barycentric_transform
-            UV1 = mathutils.Vector((UV1.x, UV1.y,1))
-            UV2 = mathutils.Vector((UV2.x, UV2.y,1))
-            UV3 = mathutils.Vector((UV3.x, UV3.y,1))
-
-            UVAtPoint = mathutils.geometry.barycentric_transform( Location, p1, p2, p3, UV1, UV2, UV3 )
-
-            UVCoord = TressFX_Float2()
-            UVCoord.x = UVAtPoint.x
-            UVCoord.y = UVAtPoint.y
-            if self.bInvertYAxisUV:
-                UVCoord.y = 1.0 - UVCoord.y; # DirectX has it inverted
-            
-            uvObj = {}
-            uvObj['x'] = UVCoord.x
-            uvObj['y'] = UVCoord.y
-            FinalObj['uvs'].append(uvObj)
-        #enumerate(FinalCurves) END
-
-        boneData = self.getTFXBoneJSON(context, FinalCurves)
-        if boneData != 'ERROR':
-            FinalObj['tfxBoneData'] = boneData
-        else:
+        boneData = self.getTFXBoneData(context, FinalNames, Bindings)
+        if boneData == 'ERROR':
             return 'ERROR'
+        BonesRegistry, RootJoints, RootWeights = boneData
+
+        if self.eOutputFormat in ('TFX_BINARY', 'BOTH'):
+            print(OutFilePath + ".tfx")
+            TFXBinaryWriter.SaveTFXBinaryFile(OutFilePath + ".tfx", Positions, UVs)
+            print(OutFilePath + ".tfxbone")
+            TFXBinaryWriter.SaveTFXBoneBinaryFile(OutFilePath + ".tfxbone", BonesRegistry.Names, RootJoints, RootWeights)
+
+        if self.eOutputFormat not in ('TFXJSON', 'BOTH'):
+            return FinalNames
+
+        print(OutFilePath + ".tfxjson")
+        with TFXJsonWriter.TFXJsonWriter(OutFilePath + ".tfxjson", self.bCompactJson) as Writer:
+            StrandFormat = Writer.ListFormat(Writer.ObjectFormat(('x', 'y', 'z', 'w')), self.nNumVertsPerStrand)
+            Writer.WriteList('positions', TFXJsonWriter.FormatRows(Positions, StrandFormat))
+            Writer.WriteList('uvs', TFXJsonWriter.FormatRows(UVs, Writer.ObjectFormat(('x', 'y'))))
+            Writer.WriteValue('numHairStrands', nNumCurves)
+            Writer.WriteValue('numVerticesPerStrand', self.nNumVertsPerStrand)
+            if self.bDebugMode:
+                Writer.WriteValue('totalNumInside', TotalNumInside)
+
+            Writer.BeginObject('tfxBoneData')
+            Writer.WriteList('skinningData', self.FormatSkinningData(Writer, FinalNames, Bindings, BonesRegistry, RootJoints, RootWeights))
+            Writer.WriteValue('numGuideStrands', nNumCurves)
+            Writer.WriteValue('bonesList', BonesRegistry.Names)
+            if self.bDebugMode:
+                Writer.WriteValue('totalIntersects', int(np.count_nonzero(Bindings.bFoundIntersection)))
+            Writer.EndObject()
+        return FinalNames
+
+    def GetTFXPositions(self, FinalPointsWorldSpace):
+        """(N, nNumVertsPerStrand, 4) float32 strand vertices as written to the files"""
+
+        #make sure they are in WS
+        Positions = np.empty(FinalPointsWorldSpace.shape[:2] + (4,), dtype=np.float32)
+        Positions[:, :, 0] = FinalPointsWorldSpace[:, :, 0]
+        if self.bInvertYAxisUV:
+            Positions[:, :, 1] = -FinalPointsWorldSpace[:, :, 1]
+        else:
+            Positions[:, :, 1] = FinalPointsWorldSpace[:, :, 1]
+        if self.bInvertZAxis:
+            Positions[:, :, 2] = -FinalPointsWorldSpace[:, :, 2] # flip in z-axis
+        else:
+            Positions[:, :, 2] = FinalPointsWorldSpace[:, :, 2]
+
+        # w component is an inverse mass
+        Positions[:, :, 3] = 1.0
+        Positions[:, :2, 3] = 0 # the first two vertices are immovable always. 
+        return Positions
+
+    def GetTFXUVs(self, Bindings):
+        """(N, 2) float32 strand texture coords at the bound points on the mesh"""
+
+        # always assume the active layer is the one to use
+        ActiveUVMap = self.oBaseMesh.data.uv_layers.active
+        LoopUVs = np.empty((len(ActiveUVMap.data), 2), dtype=np.float32)
+        ActiveUVMap.data.foreach_get('uv', LoopUVs.ravel())
+        UVs = np.einsum('nk,nkj->nj', Bindings.Barycentrics, LoopUVs[Bindings.TriLoopIndices]).astype(np.float32)
+        if self.bInvertYAxisUV:
+            UVs[:, 1] = 1.0 - UVs[:, 1] # DirectX has it inverted
+        return UVs
+
+    def FormatSkinningData(self, Writer, FinalNames, Bindings, BonesRegistry, RootJoints, RootWeights):
+        """yields the TRESSFX_MAX_INFLUENTIAL_BONE_COUNT skinningData entries of every root as json, for TFXJsonWriter.WriteList"""
+
+        # joint index -1 has no bone
+        BoneNames = [json.dumps(Name) for Name in BonesRegistry.Names] + ['""']
+        if self.bDebugMode:
+            EntryFormat = Writer.ObjectFormat(('weight', 'boneName', 'sourceVertIndex', 'rootIndex', 'curveName'), ('%s', '%s', '%d', '%d', '%s'))
+        else:
+            EntryFormat = Writer.ObjectFormat(('weight', 'boneName'), ('%s', '%s'))
+
+        for RootIndex, StrandName in enumerate(FinalNames):
+            Entries = []
+            if self.bDebugMode:
+                ClosestVertIndex = int(Bindings.ClosestVertIndices[RootIndex])
+                CurveName = json.dumps(StrandName)
+                for JointIndex, weight in zip(RootJoints[RootIndex].tolist(), RootWeights[RootIndex].tolist()):
+                    Entries.append(EntryFormat % (TFXJsonWriter.FormatFloat(weight), BoneNames[JointIndex], ClosestVertIndex if JointIndex >= 0 else -1, RootIndex, CurveName))
+            else:
+                for JointIndex, weight in zip(RootJoints[RootIndex].tolist(), RootWeights[RootIndex].tolist()):
+                    Entries.append(EntryFormat % (TFXJsonWriter.FormatFloat(weight), BoneNames[JointIndex]))
+            yield Writer.ItemSeparator.join(Entries)
 
-        with open(OutFilePath, "w") as TfxFile :
-            TfxFile.write(json.dumps(FinalObj, indent=4))
-        return FinalCurves
-
-    def getTFXBoneJSON(self, context, Finalcurves):
+    def getTFXBoneData(self, context, FinalNames, Bindings):
+        """FinalNames - names of the final strands, Bindings - RootBindings of the final strands.
+        returns (BonesRegistry, RootJoints, RootWeights) as returned by GetSkinningData, or 'ERROR'"""
 
-        VertexGroupNames = [g.name for g in self.oBaseMesh.vertex_groups]
         AllBonesArray = GetBonesFromSettings(self.oBaseMesh, self.ExportBones, self.eBoneExportMode)
-        BonesArray_WithWeightsOnly = []
-        FinalObj = {}
-        FinalObj['skinningData'] = []
 
-        TotalIntersects = 0
-        for RootIndex, CurveObj in enumerate(Finalcurves):
+        # weights of the closest vertices, read once
+        BonesRegistry, RootJoints, RootWeights = GetSkinningData(self.oBaseMesh, AllBonesArray, Bindings.ClosestVertIndices)
 
-            StrandPoints = [p.co for p in CurveObj.data.splines[0].points]
-            #TODO: root point may not always be the first point, especially if the curves were imported from a file\
-            # how to determine in that case?
-            RootPoint = StrandPoints[0]
-
-            # this will already be in mesh space if finds one
-            IntersectionPoint = FindCurveIntersectionWithMesh(CurveObj, self.oBaseMesh)            
+        if len(FinalNames) > 0 and (RootJoints[:, 0] < 0).any():
+            self.report({'ERROR'}, "No weights found for at least one root position! Make sure to whitelist or blacklist bones! Or use all with weight.")
+            return 'ERROR'
 
-            if IntersectionPoint is None:
-                if self.bDebugMode:
-                    print('no intersection point found for Rootindex: ' + str(RootIndex) + ' using rootpoint instead for weights')
-                IntersectionPoint = CurveSpaceVectorToMeshSpace(CurveObj, RootPoint, self.oBaseMesh)
-            else:
-                TotalIntersects = TotalIntersects + 1
-
-            pVector = mathutils.Vector((IntersectionPoint[0],IntersectionPoint[1],IntersectionPoint[2]))
-
-	        # Find the closest point info
-            bResult, Location, Normal, FaceIndex = self.oBaseMesh.closest_point_on_mesh(pVector)
-
-            # find closest vertex to location
-            FaceObj = self.oBaseMesh.data.polygons[FaceIndex]
-            FaceVertices = [self.oBaseMesh.data.vertices[i] for i in FaceObj.vertices]
-            ClosestVertIndex = FindIndexOfClosestVector(Location, [F.co for F in FaceVertices])
-            ClosestVert = FaceVertices[ClosestVertIndex]
-
-            ClosestVertWeights = []
-
-            for Bone in AllBonesArray:
-                weight = -1
-                try:
-                    weight = self.oBaseMesh.vertex_groups[Bone.name].weight(ClosestVert.index)                    
-                except:
-                    if self.bDebugMode:
-                        print('vertex index ' + str(ClosestVert.index) + ' is not weighted to ' + Bone.name )
-                    pass
-
-                if weight > 0 :
-                    boneweightmapObj = BoneweightmapObj()
-                    boneweightmapObj.boneName = Bone.name
-                    boneweightmapObj.weight = weight
-                    boneweightmapObj.sourceVertIndex = ClosestVert.index
-                    ClosestVertWeights.append( boneweightmapObj )
-                    if Bone.name not in BonesArray_WithWeightsOnly:
-                        BonesArray_WithWeightsOnly.append(Bone.name)
-            
-            ClosestVertWeights.sort()
-
-            if len(ClosestVertWeights) < 1:
-                self.report({'ERROR'}, "No weights found for at least one root position! Make sure to whitelist or blacklist bones! Or use all with weight.")
-                return 'ERROR'
-            #make sure we have at least TRESSFX_MAX_INFLUENTIAL_BONE_COUNT
-            while len(ClosestVertWeights) < TRESSFX_MAX_INFLUENTIAL_BONE_COUNT :
-                ClosestVertWeights.append(BoneweightmapObj())
-
-            print('root index: ' + str(RootIndex))
-            for idx in range( TRESSFX_MAX_INFLUENTIAL_BONE_COUNT):
-                boneweightmapObj = ClosestVertWeights[idx]
-                #print( boneweightmapObj.boneName )
-                #print( '    weight: ' + '{:.6f}'.format(boneweightmapObj.weight))
-                j = {}
-                j['weight'] = boneweightmapObj.weight
-                j['boneName'] = boneweightmapObj.boneName
-                if self.bDebugMode:
-                    j['sourceVertIndex'] = boneweightmapObj.sourceVertIndex
-                    j['rootIndex'] = RootIndex
-                    j['curveName'] = CurveObj.name
-                FinalObj['skinningData'].append( j )
-        #enumerate(Finalcurves):
-
-        FinalObj['numGuideStrands'] = len(Finalcurves)
-        FinalObj['bonesList'] = BonesArray_WithWeightsOnly
         if self.bDebugMode:
-            FinalObj['totalIntersects'] = TotalIntersects
-        return FinalObj
+            for RootIndex in np.flatnonzero(~Bindings.bFoundIntersection):
+                print('no intersection point found for Rootindex: ' + str(RootIndex) + ' using rootpoint instead for weights')
+
+        return BonesRegistry, RootJoints, RootWeights
 
     def execute(self, context):
         oTargetObject = context.active_object
@@ -1221,6 +1273,10 @@ class FTressFXExport(bpy.types.Operator):
         print('     bInvertYAxisUV: ' + str(self.bInvertYAxisUV))
         self.bRandomizeStrandsForLOD = oTFXProps.bRandomizeStrandsForLOD
         print('     bRandomizeStrandsForLOD: ' + str(self.bRandomizeStrandsForLOD))
+        self.eOutputFormat = oTFXProps.eOutputFormat
+        print('     eOutputFormat: ' + self.eOutputFormat)
+        self.bCompactJson = oTFXProps.bCompactJson
+        print('     bCompactJson: ' + str(self.bCompactJson))
         self.sOutputDir = oTFXProps.sOutputDir
         print('     sOutputDir: ' + str(self.sOutputDir))
         self.sOutputName = oTFXProps.sOutputName
@@ -1238,53 +1294,60 @@ class FTressFXExport(bpy.types.Operator):
             self.report({'ERROR'}, "No armature found on base mesh. Aborting")
             return {'CANCELLED'}
 
-        CurvesList = []
-
         if self.eExportType == 'PARTICLE_SYSTEM':
-            #convert particle system to mesh using convert modifier
-            bpy.ops.object.select_all(action='DESELECT')
-            bpy.context.scene.objects.active = self.oBaseMesh
-            # CurvesList = ConvertParticleSystemHairsToCurves(self.oBaseMesh, self.sParticleSystem)
-            
-            bFound = False
+
+            ParticleSystemModifier = None
             for mod in self.oBaseMesh.modifiers:
                 if mod.type == 'PARTICLE_SYSTEM' and mod.particle_system.name == self.sParticleSystem:
-                    print("Converting particle system '" + mod.particle_system.name + "' to mesh...")
-                    bpy.ops.object.modifier_convert(modifier=mod.name)
-                    bFound = True
+                    ParticleSystemModifier = mod
                     break
 
-            if bFound == False:
+            if ParticleSystemModifier is None:
                 self.report({'ERROR'}, "unable to find particle system: " + self.sParticleSystem + ". Aborting")
                 return {'CANCELLED'}
 
-            #new mesh should already be selected, convert it to curves
-            bpy.ops.object.convert(target='CURVE')
-            #separate them into invidual curves
-            print('separating into individual curves...')
-            CurvesList = SeparateCurves2(context)
+            ParticleSystem = ParticleSystemModifier.particle_system
+            if ParticleSystem.settings.child_type == 'NONE':
+                # hair keys are already in base mesh space, read them straight into arrays
+                print("Reading hair keys of particle system '" + ParticleSystem.name + "'...")
+                Points, Offsets = GetParticleHairPointsPacked(ParticleSystem)
+            else:
+                # child hairs only exist on the evaluated particle system.
+                # convert it once to a single curve and read all of its splines, no per strand objects are created
+                bpy.ops.object.select_all(action='DESELECT')
+                bpy.context.scene.objects.active = self.oBaseMesh
+                print("Converting particle system '" + ParticleSystem.name + "' to mesh...")
+                bpy.ops.object.modifier_convert(modifier=ParticleSystemModifier.name)
+                #new mesh should already be selected, convert it to curves
+                bpy.ops.object.convert(target='CURVE')
+                HairCurve = bpy.context.scene.objects.active
+                Points, Offsets = GetCurveSplinesPointsPacked(HairCurve)
+                Points = CurvesPointsToSpace(Points[np.newaxis], [HairCurve], self.oBaseMesh)[0, :, :3]
+                if not self.bDebugMode:
+                    bpy.ops.object.select_all(action='DESELECT')
+                    HairCurve.select = True
+                    bpy.ops.object.delete()
+
+            NumStrands = len(Offsets) - 1
+            StrandNames = [ParticleSystem.name + "_" + str(idx) for idx in range(NumStrands)]
         else:
             print("using selected curves as strands. Assuming they are already sperated into individual curve objects.")
             CurvesList = [p for p in bpy.context.scene.objects if p.select and p.type == 'CURVE']
+            NumStrands = len(CurvesList)
         
-        print(str(len(CurvesList)) + " curves found...")
+        print(str(NumStrands) + " curves found...")
 
-        if len(CurvesList) < TRESSFX_SIM_THREAD_GROUP_SIZE:
+        if NumStrands < TRESSFX_SIM_THREAD_GROUP_SIZE:
             self.report({'ERROR'}, "Not enough curves found, at least " + str(TRESSFX_SIM_THREAD_GROUP_SIZE) + " curves are required!")
             return {'CANCELLED'}
         
-        success = self.SaveTFXHairJsonFile(context, CurvesList)
+        if self.eExportType == 'PARTICLE_SYSTEM':
+            success = self.SaveTFXParticleHairFiles(context, Points, Offsets, StrandNames)
+        else:
+            success = self.SaveTFXHairFiles(context, CurvesList)
         if success == 'ERROR':
             return {'CANCELLED'}
 
-        if self.eExportType == 'PARTICLE_SYSTEM' and not self.bDebugMode:
-            # delete the potentially thousands of curves we generated
-            print('Deleting ' + str(len(CurvesList)) + ' temporary curves...')
-            bpy.ops.object.select_all(action='DESELECT')
-            for Curve in CurvesList:
-                bpy.data.objects[Curve.name].select = True
-            bpy.ops.object.delete()
-
         print('Done.')
         return {'FINISHED'}      
 
@@ -17,6 +17,7 @@ import bisect
 import numpy as np
 from mathutils import Vector, Quaternion
 from math import ceil, floor
+from functools import lru_cache
 
 
 def cubic_spline(locs, tknots):
@@ -70,6 +71,59 @@ def eval_spline(splines, tknots, t_in):
         out.append(pt)
     return out
 
+def cubic_spline_batch(locs, tknots):
+    """ cubic_spline for many strands at once, x, y, z solved together.
+    Args:
+        :locs - (N, n) or (N, n, 3) array of strands:
+        :tknots - (N, n) knots t for each strand:
+
+    Returns:
+        :(a, b, c, d, x) - (N, n-1, 3) spline coeff arrays for segment k and (N, n-1) segment start x:
+    """
+    a = np.asarray(locs, dtype=np.float64)
+    x = np.asarray(tknots, dtype=np.float64)
+    strands_count, n = x.shape
+    if n < 2:
+        return False
+    h = np.maximum(1e-8, x[:, 1:] - x[:, :-1])
+    q = np.zeros(a.shape)
+    q[:, 1:-1] = 3/h[:, 1:, None]*(a[:, 2:]-a[:, 1:-1]) - 3/h[:, :-1, None]*(a[:, 1:-1]-a[:, :-2])
+    l = np.ones((strands_count, n))
+    u = np.zeros((strands_count, n))
+    z = np.zeros(a.shape)
+    for i in range(1, n-1):  # tridiagonal system - forward pass, vectorized over strands and axes
+        l_i = 2*(x[:, i+1]-x[:, i-1]) - h[:, i-1]*u[:, i-1]
+        l_i[l_i == 0] = 1e-8
+        l[:, i] = l_i
+        u[:, i] = h[:, i] / l_i
+        z[:, i] = (q[:, i] - h[:, i-1, None] * z[:, i-1]) / l_i[:, None]
+    c = np.zeros(a.shape)
+    for i in range(n-2, -1, -1):
+        c[:, i] = z[:, i] - u[:, i, None]*c[:, i+1]
+    h = h[..., None]
+    b = (a[:, 1:]-a[:, :-1])/h - h*(c[:, 1:]+2*c[:, :-1])/3
+    d = (c[:, 1:]-c[:, :-1]) / (3*h)
+    return a[:, :-1], b, c[:, :-1], d, x[:, :-1]
+
+
+def eval_spline_batch(splines, tknots, t_in):
+    """ eval_spline for many strands at once.
+    Args:
+        :splines - output of cubic_spline_batch:
+        :tknots - (N, n) knots t for each strand:
+        :t_in - (N, R) or (R,) times to evaluate:
+
+    Returns:
+        :(N, R, 3) array
+    """
+    a, b, c, d, tx = splines
+    n = searchsorted_rows(tknots, t_in) - 1
+    np.clip(n, 0, tx.shape[1]-1, out=n)
+    rows = np.arange(len(tx))[:, None]
+    dt = (t_in - tx[rows, n])[..., None]
+    return a[rows, n] + b[rows, n]*dt + c[rows, n]*dt**2 + d[rows, n]*dt**3
+
+
 # import math
 # p1 = math.floor(t)
 # p2 = (p1 + 1)
@@ -88,24 +142,24 @@ def eval_spline(splines, tknots, t_in):
 # OutVec = 0.5 * (points[p0] * q1 + points[p1] * q2 + points[p2] * q3 + points[p3] * q4)
 #resampled_points = [b_spline_point_orig(points, i * (len(points) - 1.00001)/(res-1)) for i in range(res)]
 
-SPLINE_CACHE = {}
+SPLINE_CACHE_SIZE = 64
 
 
-def do_cache_coefficients(points_count, res):
-    spline_coeff = {}
-    t_multiplier = (points_count - 1.001) / (res - 1)  # t is from 0-1, for while curve
+@lru_cache(maxsize=SPLINE_CACHE_SIZE)
+def get_cached_coefficients(points_count, res):
+    """ Catmull-Rom tables for resampling strands of points_count points to res points.
+    Cached between calls (and operators) - use get_cached_coefficients.cache_info() for hits/misses.
+
+    Returns:
+        :indices - (res, 4) int array of p0..p3:
+        :coefficients - (res, 4) float array of q1..q4:
+    """
     # .001 - cos if we reach res*t_multiplier - ten last point is on end of spline - and p[-1].co = 0,0,0
-    for i in range(res):
-        spline_coeff[i] = {}
-        t_in = i * t_multiplier
-        t = t_in - floor(t_in)
-        tt = t * t
-        ttt = tt * t
-        spline_coeff[i]['q1'] = -ttt + 2.0*tt - t
-        spline_coeff[i]['q2'] = 3.0*ttt - 5.0*tt + 2.0
-        spline_coeff[i]['q3'] = -3.0*ttt + 4.0*tt + t
-        spline_coeff[i]['q4'] = ttt - tt
-    return spline_coeff
+    coefficients = get_catmull_rom_coefficients(np.arange(res) * ((points_count - 1.001) / (res - 1)))
+    indices = get_catmull_rom_indices(np.arange(res) * ((points_count - 1.01) / (res - 1)), points_count)
+    indices.flags.writeable = False  # shared between callers
+    coefficients.flags.writeable = False
+    return indices, coefficients
 
 
 def get_cubic_spline_points(points, res,  uniform_spacing, noiseStrandSeparation, shrink_ts, use_cache= True):
@@ -126,15 +180,9 @@ def get_cubic_spline_points(points, res,  uniform_spacing, noiseStrandSeparation
     resampled_points = []
     if use_cache:
         # print('Using cache')
-        global SPLINE_CACHE
-        for i in range(res): # i - is time t = i * t_map_full_rage, from <0,1> mapped to <0, point_count/res * res>
-            t = i * t_map_full_rage
-            p1 = floor(t)
-            p2 = (p1 + 1)
-            p3 = min(p2 + 1, points_len-1)
-            p0 = max(p1 - 1,  0)
-            out_pos = points[p0] * SPLINE_CACHE[i]['q1'] + points[p1] * SPLINE_CACHE[i]['q2'] + \
-                points[p2] * SPLINE_CACHE[i]['q3'] + points[p3] * SPLINE_CACHE[i]['q4']
+        indices, coefficients = get_cached_coefficients(points_len, res)
+        for (p0, p1, p2, p3), (q1, q2, q3, q4) in zip(indices.tolist(), coefficients.tolist()):
+            out_pos = points[p0] * q1 + points[p1] * q2 + points[p2] * q3 + points[p3] * q4
             resampled_points.append(0.5 * out_pos)
         return resampled_points
     else:  
@@ -160,7 +208,76 @@ def get_cubic_spline_points(points, res,  uniform_spacing, noiseStrandSeparation
 
 
 
-def get_strand_proportions2(strandsList):  # return array <0,1> - where 1 is for longest strand
+def pack_strands(strandsList):
+    """ Packs strands with different point counts into one flat array
+    Returns:
+        :points - (M, 3) float array of all strand points, one strand after another:
+        :offsets - (N+1,) int array - strand i is points[offsets[i]:offsets[i+1]]:
+    """
+    counts = [len(strand) for strand in strandsList]
+    offsets = np.zeros(len(counts) + 1, dtype=np.intp)
+    np.cumsum(counts, out=offsets[1:])
+    points = np.empty((offsets[-1], 3))
+    for strand, start, end in zip(strandsList, offsets[:-1], offsets[1:]):
+        points[start:end] = [co[:3] for co in strand]
+    return points, offsets
+
+
+def unpack_strands(points, offsets):
+    """ Inverse of pack_strands - returns list of (P_i, 3) array views """
+    return np.split(points, offsets[1:-1])
+
+
+def take_strands_packed(points, offsets, strand_ids):
+    """ Gathers strands strand_ids (in that order) from packed (points, offsets) into new packed (points, offsets) """
+    strand_ids = np.asarray(strand_ids, dtype=np.intp)
+    counts = np.diff(offsets)[strand_ids]
+    out_offsets = np.zeros(len(counts) + 1, dtype=np.intp)
+    np.cumsum(counts, out=out_offsets[1:])
+    point_ids = np.arange(out_offsets[-1]) + np.repeat(offsets[strand_ids] - out_offsets[:-1], counts)
+    return points[point_ids], out_offsets
+
+
+def subdivide_strands_packed(points, offsets, min_count):
+    """ Halves every segment of strands that have less than min_count points, until they have at least min_count points.
+    Same result as repeated curve subdivide on poly splines, done for all strands at once
+    Returns:
+        :packed (points, offsets) of subdivided strands:
+    """
+    counts = np.diff(offsets)
+    levels = np.zeros(len(counts), dtype=np.intp)  # how many times segments of each strand get halved
+    short = (counts > 1) & (counts < min_count)
+    while short.any():
+        levels += short
+        short = (counts > 1) & ((counts - 1) * 2**levels + 1 < min_count)
+    if not levels.any():
+        return points, offsets
+
+    out_counts = (counts - 1) * 2**levels + 1
+    out_offsets = np.zeros(len(counts) + 1, dtype=np.intp)
+    np.cumsum(out_counts, out=out_offsets[1:])
+    strand_ids = np.repeat(np.arange(len(counts)), out_counts)
+    u = (np.arange(out_offsets[-1]) - out_offsets[strand_ids]) / 2.0**levels[strand_ids]  # param along strand, in segments
+    seg_ids = np.minimum(np.floor(u).astype(np.intp), np.maximum(counts[strand_ids] - 2, 0))
+    f = (u - seg_ids)[:, None]
+    p0 = offsets[strand_ids] + seg_ids
+    p1 = np.minimum(p0 + 1, offsets[strand_ids + 1] - 1)
+    return points[p0] * (1 - f) + points[p1] * f, out_offsets
+
+
+def get_strand_lengths_packed(points, offsets):
+    """ Length of every strand in packed (points, offsets) representation """
+    seg_lens = np.zeros(len(points))
+    seg_lens[:-1] = np.linalg.norm(points[1:] - points[:-1], axis=1)  # do an - an-1 and get length
+    seg_lens[offsets[1:-1] - 1] = 0  # segment from last point of strand to first point of next strand
+    return np.add.reduceat(seg_lens, offsets[:-1])
+
+
+def get_strand_proportions2(strandsList, offsets=None):  # return array <0,1> - where 1 is for longest strand
+    """ strandsList - list of strands, or flat (M, 3) points array if packed strands offsets are given """
+    if offsets is not None:
+        lengthPerStrand = get_strand_lengths_packed(strandsList, offsets)
+        return (lengthPerStrand/lengthPerStrand.max()).tolist()
     lengthPerStrand = []
     for v in strandsList:
         pts = np.array(v).T
@@ -212,10 +329,6 @@ def interpol_Catmull_Rom(verts, res, uniform_spacing=False, noiseStrandSeparatio
         if not all(len(strand) == len_first for strand in verts): #if strands are not equal lengths disable caching
             # print('Not all strands have same point count. Disabling cache')
             use_cache = False
-    if use_cache:
-        global SPLINE_CACHE
-        SPLINE_CACHE.clear()
-        SPLINE_CACHE = do_cache_coefficients(len(verts[0]), res)  # assume they are eq. len
     # print('Using cache') if use_cache else print('no cache')
 
     #shorte stran leg by reducing evel time
@@ -232,13 +345,256 @@ def interpol_Catmull_Rom(verts, res, uniform_spacing=False, noiseStrandSeparatio
         noiseStrandSeparation = rand_delta_t_ins*deltaMargin*noiseStrandSeparation
 
     return [get_cubic_spline_points(splinex, res_n,  uniform_spacing, noiseStrandSeparation, t_shrink, use_cache) for splinex, t_shrink, res_n in zip(verts, shrink_ts, res_normalized)]
-    
 
 
-def get2dinterpol_Catmull_Rom(verts, IntervalX, IntervalY, shortenStrandLen, Seed, x_uniform, y_uniform, noiseStrandSeparation):
+def get_catmull_rom_coefficients(t):
+    """ q1..q4 weights for array of spline times t (only fractional part of t is used)
+    Returns:
+        :array of shape t.shape + (4,):
+    """
+    t = t - np.floor(t)
+    tt = t * t
+    ttt = tt * t
+    return np.stack((-ttt + 2.0*tt - t, 3.0*ttt - 5.0*tt + 2.0, -3.0*ttt + 4.0*tt + t, ttt - tt), axis=-1)
+
+
+def get_catmull_rom_indices(t, points_count):
+    """ p0..p3 control point indices for array of spline times t
+    Returns:
+        :int array of shape t.shape + (4,):
+    """
+    p1 = np.floor(t).astype(np.intp)
+    return np.stack((np.maximum(p1 - 1, 0), p1, p1 + 1, np.minimum(p1 + 2, points_count - 1)), axis=-1)
+
+
+def get_cubic_spline_points_batch(points, indices, coefficients):
+    """
+    Args:
+        :points - (N, P, 3) array of strands, or (M, 3) packed points (see pack_strands):
+        :indices - (res, 4) shared by all strands or (N, res, 4) per strand - from get_catmull_rom_indices.
+            For packed points (R, 4) indices into points:
+        :coefficients - q1..q4 with same shape as indices - from get_catmull_rom_coefficients:
+
+    Returns:
+        :(N, res, 3) array - spline points resampled, (R, 3) for packed points
+    """
+    if points.ndim == 2:
+        out_pos = np.zeros((len(indices), 3))
+        for k in range(4):
+            out_pos += points[indices[:, k]] * coefficients[:, k, None]
+        out_pos *= 0.5
+        return out_pos
+    out_pos = np.zeros((len(points), indices.shape[-2], 3))
+    if indices.ndim == 2:
+        for k in range(4):
+            out_pos += points[:, indices[:, k]] * coefficients[:, k, None]
+    else:
+        strand_ids = np.arange(len(points))[:, None]
+        for k in range(4):
+            out_pos += points[strand_ids, indices[..., k]] * coefficients[..., k, None]
+    out_pos *= 0.5
+    return out_pos
+
+
+def searchsorted_rows(a, v):
+    """ np.searchsorted(a[i], v[i], side='right') for every row i at once.
+    Args:
+        :a - (N, P) array with increasing rows:
+        :v - (N, R) or (R,) values to insert:
+    """
+    counts = np.zeros((len(a), np.shape(v)[-1]), dtype=np.intp)
+    for k in range(a.shape[1]):  # count knots <= v, instead of searchsorted per row
+        counts += a[:, k, None] <= v
+    return counts
+
+
+def interp_rows(x, xp, fp):
+    """ np.interp(x[i], xp[i], fp[i]) for every row i at once. Rows of xp have to be increasing.
+    Args:
+        :x - (res,) shared or (N, res) points to evaluate:
+        :xp - (P,) shared or (N, P) array:
+        :fp - (P,) shared or (N, P) values:
+    """
+    strands_count = len(xp) if np.ndim(xp) == 2 else len(fp)
+    points_count = np.shape(xp)[-1]
+    xp = np.broadcast_to(xp, (strands_count, points_count))
+    fp = np.broadcast_to(fp, (strands_count, points_count))
+    x = np.broadcast_to(x, (strands_count, np.shape(x)[-1]))
+    seg = searchsorted_rows(xp[:, 1:-1], x)  # in <0, P-2>
+    rows = np.arange(strands_count)[:, None]
+    xp_seg = xp[rows, seg]
+    fp_seg = fp[rows, seg]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slope = (fp[rows, seg + 1] - fp_seg) / (xp[rows, seg + 1] - xp_seg)
+        out = slope * (x - xp_seg) + fp_seg
+    out = np.where(x >= xp[:, -1, None], fp[:, -1, None], out)
+    return np.where(x < xp[:, :1], fp[:, :1], out)
+
+
+def interp_packed(x, x_offsets, xp, xp_offsets, fp):
+    """ np.interp(x_i, xp_i, fp_i) for every packed strand i at once. xp has to be increasing inside each strand.
+    Args:
+        :x, x_offsets - packed points to evaluate:
+        :xp, fp, xp_offsets - packed knots and values:
+    """
+    strands_count = len(xp_offsets) - 1
+    xp_ids = np.repeat(np.arange(strands_count), np.diff(xp_offsets))
+    x_ids = np.repeat(np.arange(strands_count), np.diff(x_offsets))
+    # merge knots and x per strand; at ties knots go first, same as searchsorted(side='right')
+    is_x = np.concatenate((np.zeros(len(xp), dtype=bool), np.ones(len(x), dtype=bool)))
+    order = np.lexsort((is_x, np.concatenate((xp, x)), np.concatenate((xp_ids, x_ids))))
+    knots_before = np.cumsum(~is_x[order])
+    sorted_is_x = is_x[order]
+    seg = np.empty(len(x), dtype=np.intp)
+    seg[order[sorted_is_x] - len(xp)] = knots_before[sorted_is_x]
+    seg -= 1  # knots_before counts knots of previous strands too, so it is index of segment start in xp
+    seg = np.clip(seg, xp_offsets[x_ids], xp_offsets[x_ids + 1] - 2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slope = (fp[seg + 1] - fp[seg]) / (xp[seg + 1] - xp[seg])
+        out = slope * (x - xp[seg]) + fp[seg]
+    first = xp_offsets[x_ids]
+    last = xp_offsets[x_ids + 1] - 1
+    out = np.where(x >= xp[last], fp[last], out)
+    return np.where(x < xp[first], fp[first], out)
+
+
+def get_adjusted_t_s_packed(points, offsets, res_normalized, uniform_spacing, noiseStrandSeparation, shrink_ts):
+    """ get_adjusted_t_s for packed (points, offsets) strands at once.
+    Args:
+        :res_normalized - (N,) int array - output point count for each strand:
+        :shrink_ts - (N,) array:
+    Returns:
+        :(R,) packed array of spline times and (N+1,) offsets into it, R = sum(res_normalized):
+    """
+    strands_count = len(offsets) - 1
+    vCounts = np.diff(offsets)
+    t_offsets = np.zeros(strands_count + 1, dtype=np.intp)
+    np.cumsum(res_normalized, out=t_offsets[1:])
+    t_ids = np.repeat(np.arange(strands_count), res_normalized)
+    t_idx = np.arange(t_offsets[-1]) - t_offsets[t_ids]  # i in range(res) for each strand
+    res_s = res_normalized[t_ids]
+    t_in = t_idx / (res_s-1)
+    corr_t_ins = t_in
+    if uniform_spacing:
+        point_ids = np.repeat(np.arange(strands_count), vCounts)
+        domain = (np.arange(len(points)) - offsets[point_ids]) / (vCounts[point_ids]-1)
+        seg_lens = np.zeros(len(points))
+        seg_lens[1:] = np.linalg.norm(points[:-1]-points[1:], axis=1)  # do an - an-1 and get length
+        seg_lens[offsets[:-1]] = 0  # first point of each strand
+        t = seg_lens.cumsum()
+        t -= t[offsets[point_ids]]
+        t /= t[offsets[point_ids + 1] - 1]
+        corr_t_ins = interp_packed(t_in, t_offsets, t, offsets, domain)
+    if type(noiseStrandSeparation) is np.ndarray:
+        corr_t_ins = corr_t_ins+noiseStrandSeparation[t_idx]
+        np.clip(corr_t_ins, 0, 1, out=corr_t_ins)  # cos t in (0,1)
+    t_map_full_rage = (vCounts[t_ids] - 1.01)/(res_s-1)
+    return corr_t_ins * t_map_full_rage * shrink_ts[t_ids] * (res_s-1), t_offsets  # remap from <0,1> to <0, res-1>
+
+
+def get_adjusted_t_s_batch(strands, res, uniform_spacing, noiseStrandSeparation, t_map_full_rage, shrink_ts):
+    """ get_adjusted_t_s for (N, P, 3) strands array at once. shrink_ts is (N,) array
+    Returns:
+        :(N, res) array of spline times:
+    """
+    strands_count, vCount = strands.shape[:2]
+    t_in = np.arange(res) / (res-1)
+    corr_t_ins = np.tile(t_in, (strands_count, 1))
+    if uniform_spacing:
+        domain = np.arange(vCount) / (vCount-1)
+        seg_lens = np.linalg.norm(strands[:, :-1]-strands[:, 1:], axis=2)  # do an - an-1 and get length
+        t = np.zeros((strands_count, vCount))
+        np.cumsum(seg_lens, axis=1, out=t[:, 1:])
+        t /= t[:, -1, None]
+        corr_t_ins = interp_rows(t_in, t, domain)
+    if type(noiseStrandSeparation) is np.ndarray:
+        corr_t_ins = corr_t_ins+noiseStrandSeparation
+        np.clip(corr_t_ins, 0, 1, out=corr_t_ins)  # cos t in (0,1)
+    return corr_t_ins * t_map_full_rage * shrink_ts[:, None] * (res-1)  # remap from <0,1> to <0, res-1>
+
+
+def interpol_Catmull_Rom_batch(verts, res, uniform_spacing=False, noiseStrandSeparation=0, shortenStrandLen=0, seed=2):
+    """ Catmull_Rom - same as interpol_Catmull_Rom, but all strands are resampled at once.
+    Args:
+        :verts - (N, P, 3) array - strands with same point count:
+        :res  number of points after resampling :
+        :uniform_spacing if spacing of points is uniform or not. Is not then can use cache and is faster:
+        :noiseStrandSeparation=0 - rendomize tn +/- delta:
+        :shortenStrandLen=0.0 - reduce eval T_max by  *=shrink_t:
+
+    Returns:
+        :(N, res, 3) array
+    """
+    strands = np.asarray(verts, dtype=np.float64)
+    strands_count, points_count = strands.shape[:2]
+    use_cache = not(uniform_spacing or noiseStrandSeparation or shortenStrandLen)
+
+    np.random.seed(seed)
+    if use_cache:
+        indices, coefficients = get_cached_coefficients(points_count, res)
+        return get_cubic_spline_points_batch(strands, indices, coefficients)
+
+    shrink_ts = 1.0 - np.random.uniform(0, shortenStrandLen/2, strands_count) if shortenStrandLen else np.ones(strands_count)
+    if noiseStrandSeparation:
+        rand_delta_t_ins = np.random.rand(res) - 0.5
+        deltaMargin = np.linalg.norm(strands[1][0]-strands[0][0])  # AN-A(N-1)
+        noiseStrandSeparation = rand_delta_t_ins*deltaMargin*noiseStrandSeparation
+
+    t_map_full_rage = (points_count - 1.01)/(res-1)
+    t_s_adjusted = get_adjusted_t_s_batch(strands, res, uniform_spacing, noiseStrandSeparation, t_map_full_rage, shrink_ts)
+    return get_cubic_spline_points_batch(strands, get_catmull_rom_indices(t_s_adjusted, points_count), get_catmull_rom_coefficients(t_s_adjusted))
+
+
+def interpol_Catmull_Rom_packed(points, offsets, res, uniform_spacing=False, noiseStrandSeparation=0, same_point_count=True, shortenStrandLen=0, seed=2):
+    """ Catmull_Rom - same as interpol_Catmull_Rom, for strands with different point counts packed by pack_strands
+    Args:
+        :points, offsets - packed strands:
+        :res  number of points after resampling :
+        :uniform_spacing if spacing of points is uniform or not:
+        :noiseStrandSeparation=0 - rendomize tn +/- delta:
+        :same_point_count=True if false, shorter strands = less points (smaller res):
+        :shortenStrandLen=0.0 - reduce eval T_max by  *=shrink_t:
+
+    Returns:
+        :packed (points, offsets) of resampled strands
+    """
+    points = np.asarray(points, dtype=np.float64)
+    strands_count = len(offsets) - 1
+    vCounts = np.diff(offsets)
+    use_cache = not(uniform_spacing or noiseStrandSeparation or not same_point_count or shortenStrandLen)
+    if use_cache and (vCounts == vCounts[0]).all():  # all strands have same point count, can use cached coefficients
+        out_offsets = np.arange(strands_count + 1, dtype=np.intp) * res
+        return interpol_Catmull_Rom_batch(points.reshape(strands_count, vCounts[0], 3), res, seed=seed).reshape(-1, 3), out_offsets
+
+    np.random.seed(seed)
+    shrink_ts = 1.0 - np.random.uniform(0, shortenStrandLen/2, strands_count) if shortenStrandLen else np.ones(strands_count)
+    res_normalized = np.full(strands_count, res, dtype=np.intp)
+    if not same_point_count:
+        NormalizedStrandsLength = np.array(get_strand_proportions2(points, offsets))
+        res_normalized = np.maximum(np.ceil(res * NormalizedStrandsLength), 2).astype(np.intp)
+
+    if noiseStrandSeparation:
+        rand_delta_t_ins = np.random.rand(res) - 0.5
+        deltaMargin = np.linalg.norm(points[offsets[1]]-points[offsets[0]])  # AN-A(N-1)
+        noiseStrandSeparation = rand_delta_t_ins*deltaMargin*noiseStrandSeparation
+
+    t_s_adjusted, t_offsets = get_adjusted_t_s_packed(points, offsets, res_normalized, uniform_spacing, noiseStrandSeparation, shrink_ts)
+    t_ids = np.repeat(np.arange(strands_count), res_normalized)
+    indices = get_catmull_rom_indices(t_s_adjusted, vCounts[t_ids]) + offsets[t_ids, None]
+    return get_cubic_spline_points_batch(points, indices, get_catmull_rom_coefficients(t_s_adjusted)), t_offsets
+
+
+def get2dinterpol_Catmull_Rom(verts, IntervalX, IntervalY, shortenStrandLen, Seed, x_uniform, y_uniform, noiseStrandSeparation, as_array=False):
+    """ as_array - verts is (rows, cols, 3) array, both passes are done on arrays and (IntervalX, IntervalY+1, 3) array is returned """
     wasX_res_minus_one = True if IntervalX == -1 else False
     if wasX_res_minus_one:  # do 3 splines but we will use middle one as output
         IntervalX = 3
+    if as_array:
+        x = interpol_Catmull_Rom_batch(verts, IntervalX, x_uniform, noiseStrandSeparation=noiseStrandSeparation, seed=Seed)
+        strands = np.empty((IntervalX, IntervalY + 1, 3))
+        strands[:, 0] = x[0]  # add back first row
+        strands[:, 1:] = interpol_Catmull_Rom_batch(x[1:].swapaxes(0, 1), IntervalY, y_uniform, shortenStrandLen=shortenStrandLen, seed=Seed)
+        return strands[1:2] if wasX_res_minus_one else strands
     x = interpol_Catmull_Rom(verts, IntervalX, x_uniform, noiseStrandSeparation=noiseStrandSeparation, seed=Seed)
     stramds_firstRow, *strands_afterFirst = x #splits x into x[0] + x[1:]
     strands_afterFirst_Transposed = list(zip(*strands_afterFirst))  # transpose
@@ -293,6 +649,40 @@ def parallel_transport_TNB(points):
     return (T,N)
 
 
+def parallel_transport_TNB_batch(strands):
+    '''Get (Tangents,Normals) arrays for (N, P, 3) strands array - all strands at once, Rodrigues rotation instead of Quaternion matrices'''
+    strands = np.asarray(strands, dtype=np.float64)
+    # Calculate all tangents, normalized
+    T = np.gradient(strands, axis=1)
+    T /= np.linalg.norm(T, axis=2)[..., None]
+
+    # Initialize the first parallel-transported normal vector V
+    V = np.zeros(strands.shape)
+    V[:, 0, 0] = T[:, 0, 1]
+    V[:, 0, 1] = -T[:, 0, 0]
+    V[:, 0] /= np.linalg.norm(V[:, 0], axis=1)[:, None]
+
+    # Compute the values for V for each tangential vector from T - loop over points, vectorized over strands
+    for i in range(strands.shape[1] - 1):
+        b = np.cross(T[:, i], T[:, i + 1])
+        b_len = np.linalg.norm(b, axis=1)
+        rotate = b_len >= 0.00001
+        V[:, i + 1] = V[:, i]
+        if not rotate.any():
+            continue
+        k = b[rotate] / b_len[rotate, None]
+        v = V[rotate, i]
+        phi = np.arccos(np.clip(np.einsum('ij,ij->i', T[rotate, i], T[rotate, i + 1]), -1.0, 1.0))
+        cos_phi = np.cos(phi)[:, None]
+        sin_phi = np.sin(phi)[:, None]
+        # Rodrigues rotation of v around axis k by phi
+        V[rotate, i + 1] = v * cos_phi + np.cross(k, v) * sin_phi + k * np.einsum('ij,ij->i', k, v)[:, None] * (1.0 - cos_phi)
+
+    # Calculate the second parallel-transported normal vector U
+    N = np.cross(T, V)
+    return (T, N)
+
+
 
 
 
@@ -371,7 +761,51 @@ def interpol(verts, t_in, uniform_spacing=True, noiseStrandSeparation=0, same_po
     return verts_out
 
 
-def get2dInterpol(verts, IntervalX, IntervalY, shortenStrandLen, Seed, x_uniform, y_uniform, noiseStrandSeparation):
+def interpol_batch(verts, t_in, uniform_spacing=True, noiseStrandSeparation=0, shortenStrandLen=0.0):
+    """ interpol for (N, P, 3) strands array with same_point_count=True. Returns (N, t_in, 3) array """
+    if t_in == -1:
+        t_in = 3  # we will use middle one as output single output curve
+    strands = np.asarray(verts, dtype=np.float64)
+    strands_count, vCount = strands.shape[:2]
+    if noiseStrandSeparation != 0:
+        rand_delta_t_ins = 2*np.random.rand(t_in) - 1
+    t_uniform = np.arange(t_in) / (t_in - 1)
+    domain = np.arange(vCount) / (vCount - 1)
+    tmp = np.linalg.norm(strands[:, :-1]-strands[:, 1:], axis=2)  # do an - an-1 and get length
+    t = np.zeros((strands_count, vCount))
+    np.cumsum(tmp, axis=1, out=t[:, 1:])
+    #t will containt time = dist between neighbor knots normalized
+    t /= t[:, -1, None]  # normalize; it contains info about <tn, tn+1> for spline n
+
+    corr_t_ins = np.tile(t_uniform, (strands_count, 1))
+    if not uniform_spacing:  # do lin interp for spacing instead of even spacing
+        corr_t_ins = interp_rows(t_uniform, domain, t)
+
+    if noiseStrandSeparation != 0:
+        deltaMargin = corr_t_ins[:, 1:]-corr_t_ins[:, :-1]  # AN-A(N-1)
+        margin_next = np.zeros(corr_t_ins.shape)
+        margin_next[:, :-1] = deltaMargin
+        margin_prev = np.zeros(corr_t_ins.shape)
+        margin_prev[:, 1:] = deltaMargin
+        corr_t_ins = corr_t_ins+rand_delta_t_ins*(margin_next + margin_prev)*noiseStrandSeparation
+
+    if shortenStrandLen > 0:  # randomize strand len by randomizing output domain len <0,1> to <0,x)
+        corr_t_ins = (1.0-np.random.uniform(0, shortenStrandLen, strands_count))[:, None] * corr_t_ins
+    spl = cubic_spline_batch(strands, t)
+    return eval_spline_batch(spl, t, corr_t_ins)
+
+
+def get2dInterpol(verts, IntervalX, IntervalY, shortenStrandLen, Seed, x_uniform, y_uniform, noiseStrandSeparation, as_array=False):
+    """ as_array - verts is (rows, cols, 3) array, both passes are done on arrays and (IntervalX, IntervalY+1, 3) array is returned """
+    if as_array:
+        np.random.seed(Seed)
+        interpol_hair_number = interpol_batch(verts, IntervalX, x_uniform, noiseStrandSeparation=noiseStrandSeparation)  # do spline number interpol
+        strandsPoints = np.empty((interpol_hair_number.shape[1], IntervalY + 1, 3))
+        strandsPoints[:, 0] = interpol_hair_number[0]
+        np.random.seed(Seed)
+        # do interpol over strand points, swapaxes is view - no copy
+        strandsPoints[:, 1:] = interpol_batch(interpol_hair_number[1:].swapaxes(0, 1), IntervalY, y_uniform, shortenStrandLen=shortenStrandLen)
+        return strandsPoints[1:2] if IntervalX == -1 else strandsPoints
     np.random.seed(Seed)
     interpol_hair_number = interpol(verts, IntervalX, x_uniform, noiseStrandSeparation=noiseStrandSeparation)  # do spline number interpol
     hairNumber_firstRow = interpol_hair_number[0]
@@ -18,6 +18,12 @@ import pymel.core as pymel
 import ctypes
 import random
 import sys
+
+# numpy doesn't come with every Maya version. Curves are sampled in bulk when it is available.
+try:
+    import numpy as np
+except ImportError:
+    np = None
 from maya.OpenMaya import MIntArray, MDagPathArray
 
 
@@ -39,59 +45,7 @@ if(bReload):
     reload(TressFX_Exporter)
 
 
-# Json modify
 import json
-#Use_Json = 1
-
-def Internalopen(Path,Type, Use_Json = 0):
-    if Use_Json:
-        return JsonClass(Path, Type)
-    else:
-        return open(Path, Type)
-# ctypes to dict
-def getdict(struct):
-    result = {}
-    for field, _ in struct._fields_:
-         value = getattr(struct, field)
-         # if the type is not a primitive and it evaluates to False ...
-         if (type(value) not in [int, long, float, bool]) and not bool(value):
-             # it's a null pointer
-             value = None
-         elif hasattr(value, "_length_") and hasattr(value, "_type_"):
-             # Probably an array
-             value = list(value)
-         elif hasattr(value, "_fields_"):
-             # Probably another struct
-             value = getdict(value)
-         result[field] = value
-    return result
-
-class JsonClass():
-    Path = str()
-    Type = str()
-    f = json.JSONDecoder
-    def __init__(self, Path, Type):
-        return
-        self.Path = Path
-        self.Type = Type
-        self.f = open(self.Path, "wb")
-    def write(self, InData):
-        return
-        if not self.f:
-            return
-        if isinstance(InData, ctypes._SimpleCData):
-            self.f.write(json.dumps(InData.value))
-        elif hasattr(InData, "_fields_"):
-            self.f.write(json.dumps(getdict(InData)))
-        else:
-            self.f.write(json.dumps(InData))
-        self.f.write("\n")
-    def close(self):
-        return
-        if not self.f:
-            return
-        self.f.close()
-# Json modify
 
 
 def InstallShelf():
@@ -324,6 +278,7 @@ def DoExport(*args):
     bExportSkinCheckBox = cmds.checkBox("exportSkinCheckBox", q = True, v = True)
     bExportBoneCheckBox = cmds.checkBox("exportBoneCheckBox", q = True, v = True)
     bExportJsonCheckBox = cmds.checkBox("exportJsonCheckBox", q = True, v = True)
+    bInvertYForUVs = cmds.checkBox("InvertYForUVs",q = True, v = True)
     
     #----------------------------------------
     # collect selected nurbs spline curves.
@@ -363,90 +318,131 @@ def DoExport(*args):
         cmds.warning("Please select checkbox for exporting data")
         return 
     
-    
+    if bExportSkinCheckBox == 1 or bExportBoneCheckBox == 1:
+        if meshShapedagPath == None:
+            cmds.warning("To export skin or bone data, base mesh must be set.\n")
+            return
+            
+    # bone data comes from the skin cluster of the base mesh. Check it before asking for file paths. 
+    skinClusterName = ''
+    if meshShapedagPath != None:
+        skinClusterName = GetSkinClusterName(selected_mesh_shape_name)
         
-    rootPositions = []
+    if skinClusterName == '':
+        if bExportBoneCheckBox == 1:
+            cmds.error("To export bone data, base mesh must have a skin cluster. No skin cluster found on " + selected_mesh_shape_name)
+        elif bExportJsonCheckBox == 1 and meshShapedagPath != None:
+            cmds.warning("No skin cluster found on " + selected_mesh_shape_name + ". The tfxjson file is saved without bone data.")
+            
+    #---------------------------------------------------------------------------------------------
+    # Ask for all file paths first. Strands are sampled, bound and skinned once for all the files.
+    #---------------------------------------------------------------------------------------------
+    tfxFilepath = None
+    tfxskinFilepath = None
+    tfxboneFilepath = None
+    tfxjsonFilepath = None
     
-    #-------------------
-    # Export a tfx file
-    #-------------------
     if bExportHairCheckBox:
         basicFilter = "*.tfx"
         filepath = cmds.fileDialog2(fileFilter=basicFilter, dialogStyle=2, caption="Save a tfx binary file(*.tfx)", fileMode=0)
         
         if filepath == None or len(filepath) == 0:
             return
+            
+        tfxFilepath = filepath[0]
+        
+    if bExportSkinCheckBox == 1:
+        basicFilter_tfxskin = "*.tfxskin"
+        filepath = cmds.fileDialog2(fileFilter=basicFilter_tfxskin, dialogStyle=2, caption="Save a tfxskin file(*.tfxskin)", fileMode=0)
+
+        if filepath == None or len(filepath) == 0:
+            return
+            
+        tfxskinFilepath = filepath[0]
         
+    if bExportBoneCheckBox == 1:
+        basicFilter = "*.tfxbone"
+        filepath = cmds.fileDialog2(fileFilter=basicFilter, dialogStyle=2, caption="Save a tfx bone file(*.tfxbone)", fileMode=0)
+        
+        if filepath == None or len(filepath) == 0:
+            return
+            
+        tfxboneFilepath = filepath[0]
+
+    # Json Modify
+    if bExportJsonCheckBox == 1:
+        basicFilter = "*.tfxjson"
+        filepath = cmds.fileDialog2(fileFilter=basicFilter, dialogStyle=2, caption="Save a tfx json file(*.ftxjson)",
+                                    fileMode=0)
+                                    
+        if filepath == None or len(filepath) == 0:
+            return
+            
+        tfxjsonFilepath = filepath[0]
+        
+    # mesh data shared by all exported files, built once all file paths are confirmed
+    meshContext = None
+    if meshShapedagPath != None:
+        meshContext = MeshExportContext(meshShapedagPath)
+        
+    #--------------------------------------------------------------------
+    # Sample strands once. tfx and tfxjson files share the strand order. 
+    #--------------------------------------------------------------------
+    numVerticesPerStrand = int(cmds.optionMenu("numberOfStrandsOptionMenu", query=True, value=True))
+    invertZ = cmds.checkBox("InvertZ",q = True, v = True)
+    
+    positions = None
+    rootPositions = []
+    
+    if bExportHairCheckBox or bExportJsonCheckBox:
         bRandomize = cmds.checkBox("randomStrandCheckBox", q = True, v = True)
         
         if bRandomize:
             random.shuffle(curves)
             
-        rootPositions, tmpDicTfx = SaveTFXBinaryFile(filepath[0], curves, meshShapedagPath)
-    
-    #------------------------------------------------------------------------------------
-    # collect root positions for tfxskin or tfxbone in case SaveTFXBinaryFile was not run
-    #------------------------------------------------------------------------------------
-    if bExportHairCheckBox == 0 and (bExportSkinCheckBox == 1 or bExportBoneCheckBox == 1):
+        positions, rootPositions = GetStrandPositions(curves, numVerticesPerStrand, invertZ)
+    else:
+        # only root positions are needed for tfxskin or tfxbone 
         for i in xrange(len(curves)):
             curveFn = curves[i]
             rootPos = OpenMaya.MPoint()
             curveFn.getPointAtParam(0, rootPos, OpenMaya.MSpace.kObject) # kWorld?
             rootPositions.append(rootPos)
-     
-    if bExportSkinCheckBox == 1 or bExportBoneCheckBox == 1:
-        if selected_mesh_shape_name == '':
-            cmds.warning("To export skin or bone data, base mesh must be set.\n")
-            return
+            
+    # strand uvs and bone data from the root bindings
+    uvs = None
+    boneData = None
+    
+    if meshContext != None and (bExportHairCheckBox or bExportJsonCheckBox):
+        uvs = GetStrandUVs(meshContext, rootPositions, bInvertYForUVs)
+        
+    if skinClusterName != '' and (bExportBoneCheckBox or bExportJsonCheckBox):
+        boneData = GetBoneData(skinClusterName, meshContext, rootPositions)
+        
+    #-------------------
+    # Export a tfx file
+    #-------------------
+    if tfxFilepath != None:
+        SaveTFXBinaryFile(tfxFilepath, positions, numVerticesPerStrand, uvs)
             
     #--------------------    
     # Save tfxskin file
     #--------------------
-    if bExportSkinCheckBox == 1:
-        basicFilter_tfxskin = "*.tfxskin"
-        filepath = cmds.fileDialog2(fileFilter=basicFilter_tfxskin, dialogStyle=2, caption="Save a tfxskin file(*.tfxskin)", fileMode=0)
-
-        if filepath == None or len(filepath) == 0:
-            return
-        
-        SaveTFXSkinBinaryFile(filepath[0], meshShapedagPath, rootPositions)
+    if tfxskinFilepath != None:
+        SaveTFXSkinBinaryFile(tfxskinFilepath, meshContext, rootPositions, bInvertYForUVs)
         
     #------------------------
     # Save the tfxbone file.
     #------------------------
-    if bExportBoneCheckBox == 1:
-        basicFilter = "*.tfxbone"
-        filepath = cmds.fileDialog2(fileFilter=basicFilter, dialogStyle=2, caption="Save a tfx bone file(*.tfxbone)", fileMode=0)
-        
-        if filepath == None or len(filepath) == 0:
-            return
-
-        SaveTFXBoneBinaryFile(filepath[0], selected_mesh_shape_name, meshShapedagPath, rootPositions)
+    if tfxboneFilepath != None:
+        SaveTFXBoneBinaryFile(tfxboneFilepath, boneData)
 
     # Json Modify
     # ------------------------
     # Save the tfxjson file.
     # ------------------------
-    if bExportJsonCheckBox == 1:
-        basicFilter = "*.tfxjson"
-        filepath = cmds.fileDialog2(fileFilter=basicFilter, dialogStyle=2, caption="Save a tfx json file(*.ftxjson)",
-                                    fileMode=0)
-
-        bRandomize = cmds.checkBox("randomStrandCheckBox", q=True, v=True)
-        if bRandomize:
-            random.shuffle(curves)
-        rootPositions, DicTfx = SaveTFXBinaryFile(filepath[0], curves, meshShapedagPath, 1)
-        DicBone = SaveTFXBoneBinaryFile(filepath[0], selected_mesh_shape_name, meshShapedagPath, rootPositions, 1)
-
-        if DicBone is not None:
-            DicTfx = dict(DicTfx, **DicBone)
-        #f = Internalopen(filepath[0], "wb", 1)
-        #f.write(MergeDic)
-        #f.close()
-        f = open(filepath[0], "wb")
-        f.write(json.dumps(DicTfx))
-        f.close()
-
+    if tfxjsonFilepath != None:
+        SaveTFXJsonFile(tfxjsonFilepath, positions, numVerticesPerStrand, uvs, boneData)
 
     return
            
@@ -479,6 +475,60 @@ class WeightJointIndexPair:
     def __lt__(self, other):
         return self.weight > other.weight
         
+# Returns the joint indices and weights of the maxJointsPerVertex most weighted influences of every mesh vertex, sorted by weight. 
+# Both are flat lists of maxJointsPerVertex entries per vertex. Empty entries have joint index -1 and zero weight. 
+# The weights of all vertices are fetched with one getWeights call over the complete vertex component. 
+def GetSortedJointWeights(skinFn, meshShapedagPath, maxJointsPerVertex):
+    numVertices = OpenMaya.MFnMesh(meshShapedagPath).numVertices()
+    
+    componentFn = OpenMaya.MFnSingleIndexedComponent()
+    components = componentFn.create(OpenMaya.MFn.kMeshVertComponent)
+    componentFn.setCompleteData(numVertices)
+    
+    weights = OpenMaya.MDoubleArray() # all bones for each vertex, even not weighted
+    infCount = OpenMaya.MScriptUtil()
+    infCountPtr = infCount.asUintPtr()
+    skinFn.getWeights(meshShapedagPath, components, weights, infCountPtr)
+    numInfluences = OpenMaya.MScriptUtil.getUint(infCountPtr)
+    
+    numJoints = min(maxJointsPerVertex, numInfluences)
+    
+    if np is not None:
+        # read the MDoubleArray straight into a float64 array of known size, one row per vertex
+        weights = np.fromiter(weights, dtype=np.float64, count=weights.length()).reshape(numVertices, numInfluences)
+        
+        if numJoints < numInfluences:
+            jointIndices = np.argpartition(-weights, numJoints - 1, axis=1)[:, :numJoints]
+        else:
+            jointIndices = np.tile(np.arange(numInfluences), (numVertices, 1))
+            
+        rows = np.arange(numVertices)[:, None]
+        jointWeights = weights[rows, jointIndices]
+        
+        # sort with weight, lower weight will fall behind. Equal weights keep the joint order. 
+        order = np.lexsort((jointIndices, -jointWeights))
+        
+        jointIndexArray = np.full((numVertices, maxJointsPerVertex), -1, dtype=np.int64)
+        weightArray = np.zeros((numVertices, maxJointsPerVertex), dtype=np.float64)
+        jointIndexArray[:, :numJoints] = jointIndices[rows, order]
+        weightArray[:, :numJoints] = jointWeights[rows, order]
+        
+        return jointIndexArray.ravel().tolist(), weightArray.ravel().tolist()
+        
+    weights = [weights[i] for i in xrange(weights.length())]
+    weightArray = [0] * maxJointsPerVertex * numVertices
+    jointIndexArray = [-1] * maxJointsPerVertex * numVertices
+    
+    for index in xrange(numVertices):
+        vertexWeights = weights[index*numInfluences:(index+1)*numInfluences]
+        sortedJointIndices = sorted(range(numInfluences), key=lambda i: -vertexWeights[i])
+        
+        for a in range(numJoints):
+            weightArray[index*maxJointsPerVertex + a] = vertexWeights[sortedJointIndices[a]]
+            jointIndexArray[index*maxJointsPerVertex + a] = sortedJointIndices[a]
+            
+    return jointIndexArray, weightArray
+    
 # vertexIndices is three vertex indices belong to one triangle
 def GetSortedWeightsFromTriangleVertices(_maxJointsPerVertex, vertexIndices, jointIndexArray, weightArray, baryCoord):
     final_pairs = []
@@ -520,6 +570,72 @@ def GetSortedWeightsFromTriangleVertices(_maxJointsPerVertex, vertexIndices, joi
     # If you really want it to be exactly _maxJointsPerVertex, you can try to pop out elements. 
     return final_pairs            
     
+# Batch version of GetSortedWeightsFromTriangleVertices for all strands at once. 
+# triangleVertexIndices and baryCoords hold three vertex indices and barycentric coordinates for each strand. 
+# jointIndexArray and weightArray are per vertex as returned by GetSortedJointWeights. 
+# Weights of the same joint are summed, and the _maxJointsPerVertex largest ones are kept, sorted by weight. 
+# Returns joint indices and weights as lists of _maxJointsPerVertex entries per strand. The joint index is zero where the weight is zero. 
+# It only works on plain index and weight arrays and calls nothing from Maya, but it stays in this file so that the plug-in remains a single file to copy. 
+def BlendTriangleJointWeights(_maxJointsPerVertex, triangleVertexIndices, jointIndexArray, weightArray, baryCoords):
+    numStrands = len(triangleVertexIndices)
+    
+    if np is None:
+        strandJoints = []
+        strandWeights = []
+        
+        for i in xrange(numStrands):
+            final_pairs = GetSortedWeightsFromTriangleVertices(_maxJointsPerVertex, triangleVertexIndices[i], jointIndexArray, weightArray, baryCoords[i])
+            final_pairs = final_pairs[:_maxJointsPerVertex]
+            padding = [0] * (_maxJointsPerVertex - len(final_pairs))
+            strandJoints.append([pair.joint_index for pair in final_pairs] + padding)
+            strandWeights.append([pair.weight for pair in final_pairs] + padding)
+            
+        return strandJoints, strandWeights
+        
+    numPairs = 3 * _maxJointsPerVertex
+    vertexIndices = np.array(triangleVertexIndices, dtype=np.int64).reshape(numStrands, 3)
+    vertexJoints = np.array(jointIndexArray, dtype=np.int64).reshape(-1, _maxJointsPerVertex)
+    vertexWeights = np.array(weightArray, dtype=np.float64).reshape(-1, _maxJointsPerVertex)
+    
+    # all joints of the three vertices of each strand, weights scaled by the barycentric coordinates
+    strands = np.repeat(np.arange(numStrands), numPairs)
+    joints = vertexJoints[vertexIndices].ravel()
+    weights = (vertexWeights[vertexIndices] * np.array(baryCoords, dtype=np.float64).reshape(numStrands, 3, 1)).ravel()
+    
+    # the order GetSortedWeightsFromTriangleVertices visits the pairs in: slot by slot, three vertices each
+    visits = np.tile((np.arange(_maxJointsPerVertex) * 3 + np.arange(3)[:, None]).ravel(), numStrands)
+    
+    # sum the weights of the same joint in a strand. Sorting by strand and joint puts them next to each other, 
+    # in visiting order, so each joint keeps the position it was first visited at. 
+    order = np.lexsort((visits, joints, strands))
+    strands = strands[order]
+    joints = joints[order]
+    bRunStart = np.concatenate(([True], (strands[1:] != strands[:-1]) | (joints[1:] != joints[:-1])))
+    runStarts = np.flatnonzero(bRunStart)
+    # bincount adds up each run one weight after another, in the same order as final_pairs[k].weight += weight
+    weights = np.bincount(np.cumsum(bRunStart) - 1, weights=weights[order])
+    strands = strands[runStarts]
+    joints = joints[runStarts]
+    visits = visits[order][runStarts]
+    
+    # Set joint index zero if the weight is zero. 
+    joints[weights == 0] = 0
+    
+    # sort with weight in each strand, lower weight will fall behind, and keep the first _maxJointsPerVertex. 
+    # Equal weights keep the visiting order like the stable sort of final_pairs. 
+    order = np.lexsort((visits, -weights, strands))
+    strands = strands[order]
+    firstInStrand = np.searchsorted(strands, strands)
+    ranks = np.arange(len(strands)) - firstInStrand
+    bKeep = ranks < _maxJointsPerVertex
+    
+    strandJoints = np.zeros((numStrands, _maxJointsPerVertex), dtype=np.int64)
+    strandWeights = np.zeros((numStrands, _maxJointsPerVertex), dtype=np.float64)
+    strandJoints[strands[bKeep], ranks[bKeep]] = joints[order][bKeep]
+    strandWeights[strands[bKeep], ranks[bKeep]] = weights[order][bKeep]
+    
+    return strandJoints.tolist(), strandWeights.tolist()
+    
 # p0, p1, p2 are three vertices of a triangle and p is inside the triangle
 def ComputeBarycentricCoordinates(p0, p1, p2, p):
     v0 = p1 - p0
@@ -549,148 +665,116 @@ def ComputeBarycentricCoordinates(p0, p1, p2, p):
  
     return [u, v, w]
     
-def SaveTFXBoneBinaryFile(filepath, selected_mesh_shape_name, meshShapedagPath, rootPositions, Use_Json = 0):
-    #---------------------------------------------------------------------------
-    # Build a face/triangle index list to convert face index into triangle index
-    #---------------------------------------------------------------------------
-    faceIter = OpenMaya.MItMeshPolygon(meshShapedagPath)
-    triangleCount = 0
-    faceTriaIndexList = []
-    index = 0
-
-    util = OpenMaya.MScriptUtil()
-    util.createFromInt(0)
-    
-    while not faceIter.isDone():
-        faceTriaIndexList.append(triangleCount)
-        
-        if faceIter.hasValidTriangulation():
-            numTrianglesPtr = util.asIntPtr()
-            faceIter.numTriangles(numTrianglesPtr)
-            numTriangles = util.getInt(numTrianglesPtr)        
-            triangleCount += numTriangles
-
-        faceIter.next()
-
-    #print "TressFX: Triangle count:%d\n" % triangleCount
-
-    #----------------------
-    # Find the closest face
-    #----------------------
-    meshFn = OpenMaya.MFnMesh(meshShapedagPath)
-    meshIntersector = OpenMaya.MMeshIntersector()
-    meshIntersector.create(meshShapedagPath.node())
-    
-    triangleCounts = OpenMaya.MIntArray()
-    triangleVertexIndices = OpenMaya.MIntArray() # the size of this array is three times of the number of total triangles
-    meshFn.getTriangles(triangleCounts, triangleVertexIndices)
-    
-    vertexTriangleList = []
-
-    triangleIdForStrandsList = []
-    baryCoordList = []
-    uvCoordList = []
-    pointOnMeshList = []
-
-    progressBar = ProgressBar('Collecting bone data', len(rootPositions))
-    
-    for i in range(len(rootPositions)):
-        rootPoint = rootPositions[i]
-
-        # Find the closest point info
-        meshPt = OpenMaya.MPointOnMesh()
-        meshIntersector.getClosestPoint(rootPoint, meshPt)
-        pt = meshPt.getPoint()
-
-        pointOnMesh = OpenMaya.MPoint()
-        pointOnMesh.x = pt.x
-        pointOnMesh.y = pt.y
-        pointOnMesh.z = pt.z
-        #print [pointOnMesh.x, pointOnMesh.y, pointOnMesh.z]
-        pointOnMeshList.append(pointOnMesh)
-        
-        # Find face index
-        faceId = meshPt.faceIndex()
-        
-        # Find triangle index
-        triangleId = faceTriaIndexList[faceId] + meshPt.triangleIndex()
-        
-        dummy = OpenMaya.MScriptUtil()
-        dummyIntPtr = dummy.asIntPtr()
-        triangleId_local = meshPt.triangleIndex() # This values is either 0 or 1. It is not a global triangle index. triangleId is the global triangle index. 
-        pointArray = OpenMaya.MPointArray()
-        vertIdList = OpenMaya.MIntArray()
-        faceIter.setIndex(faceId, dummyIntPtr)
-        faceIter.getTriangle(triangleId_local, pointArray, vertIdList, OpenMaya.MSpace.kWorld )
-        
-        vertexTriangleList.append((vertIdList[0], vertIdList[1], vertIdList[2]))
-        triangleIdForStrandsList.append(triangleId)
-
-        # Find three vertex indices for the triangle. Following two lines should give us three correct vertex indices for the triangle. I haven't really verified though. 
-        #vertexIndex = [triangleVertexIndices[triangleId*3], triangleVertexIndices[triangleId*3+1], triangleVertexIndices[triangleId*3+2]]
-        vertexIndex = [vertIdList[0], vertIdList[1], vertIdList[2]]
-                    
-        # Find barycentric coordinates
-        uvw = OpenMaya.MPoint()
+# Where a strand root sits on the base mesh
+class RootBinding:
+    triangleId = 0 # global triangle index
+    vertexIndices = (0, 0, 0) # three vertex indices of the triangle
+    meshBaryCoord = (0, 0, 0) # barycentric coordinates from MPointOnMesh
+    baryCoord = (0, 0, 0) # non-negative barycentric coordinates summing to 1 for blending bone weights
+    uv = (0, 0) # texture coordinates at the root
+    
+# Base mesh data shared by all files of one export. The intersector, the face/triangle index list and the triangles
+# are built once, and root bindings are cached so that tfx, tfxskin and tfxbone files don't search the mesh again. 
+class MeshExportContext:
+    def __init__(self, meshShapedagPath):
+        self.dagPath = meshShapedagPath
+        self.meshFn = OpenMaya.MFnMesh(meshShapedagPath)
+        self.meshIntersector = OpenMaya.MMeshIntersector()
+        self.meshIntersector.create(meshShapedagPath.node())
         
-        # Somehow, below code gives me negative barycentric coordinates sometimes. 
-        # uPtr = OpenMaya.MScriptUtil().asFloatPtr()
-        # vPtr = OpenMaya.MScriptUtil().asFloatPtr()
-        # meshPt.getBarycentricCoords(uPtr,vPtr)
-        # uvw.x = OpenMaya.MScriptUtil(uPtr).asFloat()
-        # uvw.y = OpenMaya.MScriptUtil(vPtr).asFloat()
-        # uvw.z = 1.0 - uvw.x - uvw.y  
+        triangleCounts = OpenMaya.MIntArray()
+        self.triangleVertexIndices = OpenMaya.MIntArray() # the size of this array is three times of the number of total triangles
+        self.meshFn.getTriangles(triangleCounts, self.triangleVertexIndices)
         
-        # Instead getting barycentric coords from getBarycentricCoords, we compute it by the following function. 
-        uvw_a = ComputeBarycentricCoordinates(pointArray[0], pointArray[1], pointArray[2], pointOnMesh)
-      
-        uvw.x = uvw_a[0]
-        uvw.y = uvw_a[1]
-        uvw.z = uvw_a[2]
+        # face/triangle index list to convert face index into triangle index
+        self.faceTriaIndexList = [0] * triangleCounts.length()
+        triangleCount = 0
+        for i in xrange(triangleCounts.length()):
+            self.faceTriaIndexList[i] = triangleCount
+            triangleCount += triangleCounts[i]
+            
+        self.points = OpenMaya.MPointArray()
+        self.meshFn.getPoints(self.points, OpenMaya.MSpace.kWorld)
         
-        # barycentric coordinates should be non-zero
-        uvw.x = max(uvw.x, 0)
-        uvw.y = max(uvw.y, 0)
-        uvw.z = max(uvw.z, 0)
+        self.rootPositions = None
+        self.rootBindings = []
         
-        # normalize barycentric coordinates so that their sum is equal to 1
-        sum = uvw.x + uvw.y + uvw.z
-        uvw.x /= sum
-        uvw.y /= sum
-        uvw.z /= sum
-
-        baryCoordList.append(uvw)
+    # Returns a RootBinding for each root position. They are computed once for the same rootPositions list. 
+    def GetRootBindings(self, rootPositions):
+        if rootPositions is self.rootPositions:
+            return self.rootBindings
+            
+        self.rootPositions = rootPositions
+        self.rootBindings = []
         
-        # Find UV coordinates - We don't really use UV coords for tfxbone file. 
-        # util = OpenMaya.MScriptUtil()
-        # util.createFromList([0.0, 0.0], 2)
-        # uv_ptr = util.asFloat2Ptr()
-        # meshFn.getUVAtPoint(rootPoint, uv_ptr)
-        # u = OpenMaya.MScriptUtil.getFloat2ArrayItem(uv_ptr, 0, 0)
-        # v = OpenMaya.MScriptUtil.getFloat2ArrayItem(uv_ptr, 0, 1)
-        # uv_coord = OpenMaya.MPoint()
-        # uv_coord.x = u
-        # uv_coord.y = v
-        # uv_coord.z = 0
-        # uvCoordList.append(uv_coord)
-
-        # update progress gui
-        progressBar.Increment()
+        progressBar = ProgressBar('Binding strand roots', len(rootPositions))
+        util = OpenMaya.MScriptUtil()
+        util.createFromList([0.0, 0.0], 2)
+        uUtil = OpenMaya.MScriptUtil()
+        uPtr = uUtil.asFloatPtr()
+        vUtil = OpenMaya.MScriptUtil()
+        vPtr = vUtil.asFloatPtr()
         
-    progressBar.Kill()
-    
-    #-------------------------
-    # Get skin cluster object 
-    #-------------------------     
-    skinClusterName = ''
-    skinClusters = cmds.listHistory(selected_mesh_shape_name)
+        for rootPoint in rootPositions:
+            binding = RootBinding()
+            
+            # Find the closest point info
+            meshPt = OpenMaya.MPointOnMesh()
+            self.meshIntersector.getClosestPoint(rootPoint, meshPt)
+            pt = meshPt.getPoint()
+            pointOnMesh = OpenMaya.MPoint(pt.x, pt.y, pt.z)
+            
+            # Find triangle index
+            binding.triangleId = self.faceTriaIndexList[meshPt.faceIndex()] + meshPt.triangleIndex()
+            binding.vertexIndices = (self.triangleVertexIndices[binding.triangleId*3], 
+                                     self.triangleVertexIndices[binding.triangleId*3+1], 
+                                     self.triangleVertexIndices[binding.triangleId*3+2])
+            
+            # Find barycentric coordinates. Those from getBarycentricCoords can be negative sometimes, 
+            # so bone weights are blended with the ones computed by ComputeBarycentricCoordinates. 
+            meshPt.getBarycentricCoords(uPtr, vPtr)
+            u = OpenMaya.MScriptUtil(uPtr).asFloat()
+            v = OpenMaya.MScriptUtil(vPtr).asFloat()
+            binding.meshBaryCoord = (u, v, 1.0 - u - v)
+            binding.baryCoord = tuple(ComputeBarycentricCoordinates(self.points[binding.vertexIndices[0]], 
+                                                                    self.points[binding.vertexIndices[1]], 
+                                                                    self.points[binding.vertexIndices[2]], 
+                                                                    pointOnMesh))
+            
+            # Find UV coordinates 
+            uv_ptr = util.asFloat2Ptr()
+            self.meshFn.getUVAtPoint(rootPoint, uv_ptr)
+            binding.uv = (OpenMaya.MScriptUtil.getFloat2ArrayItem(uv_ptr, 0, 0), 
+                          OpenMaya.MScriptUtil.getFloat2ArrayItem(uv_ptr, 0, 1))
+            
+            self.rootBindings.append(binding)
+            progressBar.Increment()
+            
+        progressBar.Kill()
+        return self.rootBindings
+    
+def removeBoneNameAscii(boneName):
+    # work for unreal
+    while 'FBXASC' in boneName:
+        boneName = boneName.replace('FBXASC032','-')
+        boneName = boneName.replace('FBXASC040','(')
+        boneName = boneName.replace('FBXASC041',')')
+    return boneName
+
+# Returns the name of the first skin cluster in the history of the mesh shape, or '' if it has none.
+def GetSkinClusterName(mesh_shape_name):
+    skinClusters = cmds.listHistory(mesh_shape_name)
     skinClusters = cmds.ls(skinClusters, type="skinCluster")
     if skinClusters:
-        skinClusterName = skinClusters[0]
-    else:
-        cmds.warning('No skin cluster found on '+ selected_mesh_shape_name)
-        return
-    
+        return skinClusters[0]
+    return ''
+
+# Returns influence object names and the joint indices and weights of each strand, TRESSFX_MAX_INFLUENTIAL_BONE_COUNT per strand.
+# skinClusterName is the skin cluster of the mesh, see GetSkinClusterName. 
+def GetBoneData(skinClusterName, meshContext, rootPositions):
+    meshShapedagPath = meshContext.dagPath
+    rootBindings = meshContext.GetRootBindings(rootPositions)
+
     #print skinClusterName
     
     #---------------------------------------------------------------------------------------------------
@@ -730,58 +814,25 @@ def SaveTFXBoneBinaryFile(filepath, selected_mesh_shape_name, meshShapedagPath,
         influenceObjectsNames.append(influenceName) # Need to remove namespace?
         #print influenceName
     
-    skinMeshes = cmds.skinCluster(skinClusterName, query=1, geometry=1)
-    geoIter = OpenMaya.MItGeometry(meshShapedagPath)
-    infCount = OpenMaya.MScriptUtil()
-    infCountPtr = infCount.asUintPtr()   
-    numVertices = geoIter.count()
-    
-    weightArray = [0] * TRESSFX_MAX_INFLUENTIAL_BONE_COUNT  * numVertices # joint weight array for all vertices. Each vertex will have TRESSFX_MAX_INFLUENTIAL_BONE_COUNT  weights. 
-                                                         # It is initialized with zero for empty weight in case there are less weights than TRESSFX_MAX_INFLUENTIAL_BONE_COUNT .
-    jointIndexArray = [-1] * TRESSFX_MAX_INFLUENTIAL_BONE_COUNT  * numVertices # joint index array for all vertices. It is initialized with -1 for an empty element in case 
-                                                              # there are less weights than TRESSFX_MAX_INFLUENTIAL_BONE_COUNT . 
-
     # collect bone weights for all vertices in the mesh
-    index = 0
-    maxWeightCount = 0
+    jointIndexArray, weightArray = GetSortedJointWeights(skinFn, meshShapedagPath, TRESSFX_MAX_INFLUENTIAL_BONE_COUNT)
 
-    while geoIter.isDone() == False:
-        weights = OpenMaya.MDoubleArray()
-        skinFn.getWeights(meshShapedagPath, geoIter.currentItem(), weights, infCountPtr)
-        
-        weightJointIndexPairs = []
-        
-        for i in range(len(weights)): # all bones, even not weighted
-            pair = WeightJointIndexPair()
-            pair.weight = weights[i]
-            pair.joint_index = i 
-            weightJointIndexPairs.append(pair)
-    
-        weightJointIndexPairs.sort() #sort with weight, lower weight will fall behind
+    # blend the weights of three vertices of the root triangle for all strands at once
+    strandJoints, strandWeights = BlendTriangleJointWeights(TRESSFX_MAX_INFLUENTIAL_BONE_COUNT,
+                                                            [binding.vertexIndices for binding in rootBindings],
+                                                            jointIndexArray, weightArray,
+                                                            [binding.baryCoord for binding in rootBindings])
 
-        # if len(weightJointIndexPairs) > TRESSFX_MAX_INFLUENTIAL_BONE_COUNT:
-        #     sys.stderr.write("bone weight count excced two important bones: "+influenceObjectsNames[weightJointIndexPairs[0].joint_index]+","+influenceObjectsNames[weightJointIndexPairs[1].joint_index])
-        #     maxWeightCount = max(maxWeightCount, len(weightJointIndexPairs))
-        
-        a = 0
+    return influenceObjectsNames, strandJoints, strandWeights
 
-        weightJointIndexPairsLen = min(TRESSFX_MAX_INFLUENTIAL_BONE_COUNT, len(weightJointIndexPairs))
-        for j in range(weightJointIndexPairsLen):
-            weightArray[index*TRESSFX_MAX_INFLUENTIAL_BONE_COUNT  + a] = weightJointIndexPairs[j].weight
-            jointIndexArray[index*TRESSFX_MAX_INFLUENTIAL_BONE_COUNT  + a] = weightJointIndexPairs[j].joint_index
-            a += 1
+def SaveTFXBoneBinaryFile(filepath, boneData):
+    influenceObjectsNames, strandJoints, strandWeights = boneData
 
-        index += 1
-        geoIter.next()
-
-    if maxWeightCount > TRESSFX_MAX_INFLUENTIAL_BONE_COUNT:
-        raise Exception()
-    
     #------------------------
     # Save the tfxbone file.
     #------------------------
-    progressBar = ProgressBar('Saving a tfxbone file', len(influenceObjectsNames) + len(triangleIdForStrandsList))
-    f = Internalopen(filepath, "wb", Use_Json)
+    progressBar = ProgressBar('Saving a tfxbone file', len(influenceObjectsNames) + len(strandJoints))
+    f = open(filepath, "wb")
     # Number of Bones
     f.write(ctypes.c_int(len(influenceObjectsNames)))
 
@@ -799,49 +850,78 @@ def SaveTFXBoneBinaryFile(filepath, selected_mesh_shape_name, meshShapedagPath,
         progressBar.Increment()
 
     # Number of Strands
-    f.write(ctypes.c_int(len(triangleIdForStrandsList)))
+    f.write(ctypes.c_int(len(strandJoints)))
 
-    def removeBoneNameAscii(boneName):
-        # work for unreal
-        while 'FBXASC' in boneName:
-            boneName = boneName.replace('FBXASC032','-')
-            boneName = boneName.replace('FBXASC040','(')
-            boneName = boneName.replace('FBXASC041',')')
-        return boneName
+    for i in range(len(strandJoints)):
+        joints = strandJoints[i]
+        weights = strandWeights[i]
+
+        # Index, the rest should be self explanatory.
+        f.write(ctypes.c_int(i))
+        for k in range(0, TRESSFX_MAX_INFLUENTIAL_BONE_COUNT):
+            f.write(ctypes.c_int(joints[k]))
+            f.write(ctypes.c_float(weights[k]))
+
+        progressBar.Increment()
+
+    f.close()
+    progressBar.Kill()
+    return
+
+# Json Modify
+# Saves strand vertices, uvs (can be None) and bone data (can be None) in one tfxjson file.
+def SaveTFXJsonFile(filepath, positions, numVerticesPerStrand, uvs, boneData):
+    numCurves = len(positions) / numVerticesPerStrand
 
-    # Json Modify
     FDict = {}
-    if Use_Json:
+    FDict["positions"] = []
+    FDict["uvs"] = []
+    FDict["numVerticesPerStrand"] = numVerticesPerStrand
+    FDict["numHairStrands"] = numCurves
+
+    for i in xrange(numCurves):
+        tmp = []
+        for j in range(0, numVerticesPerStrand):
+            p = positions[i * numVerticesPerStrand + j]
+            tmp.append(
+                {
+                    "w":p.w,
+                    "x":p.x,
+                    "y":p.y,
+                    "z":p.z,
+                }
+            )
+        FDict["positions"].append(tmp)
+
+    if uvs != None:
+        for uv_coord in uvs:
+            FDict["uvs"].append(
+                {
+                    "x": uv_coord.x,
+                    "y": uv_coord.y,
+                }
+            )
+
+    if boneData != None:
+        influenceObjectsNames, strandJoints, strandWeights = boneData
+
         FDict["tfxBoneData"] = {"skinningData": []}
         FDict["tfxBoneData"]["bonesList"] = []
-        FDict["tfxBoneData"]["numGuideStrands"] = len(triangleIdForStrandsList)
+        FDict["tfxBoneData"]["numGuideStrands"] = len(strandJoints)
         for i in range(len(influenceObjectsNames)):
             FDict["tfxBoneData"]["bonesList"].append(removeBoneNameAscii(influenceObjectsNames[i]))
 
-            #print influenceObjectsNames
-    for i in range(len(triangleIdForStrandsList)):
-        triangleId = triangleIdForStrandsList[i]
-        
-        # three vertex indices from one triangle - Following two lines should work equally but I haven't verified it yet. 
-        #vertexIndices = [triangleVertexIndices[triangleId*3], triangleVertexIndices[triangleId*3+1], triangleVertexIndices[triangleId*3+2]]
-        vertexIndices = vertexTriangleList[i]
-
-        baryCoord = baryCoordList[i]
-        weightJointIndexPairs = GetSortedWeightsFromTriangleVertices(TRESSFX_MAX_INFLUENTIAL_BONE_COUNT , vertexIndices, jointIndexArray, weightArray, baryCoord)
+        for i in range(len(strandJoints)):
+            joints = strandJoints[i]
+            weights = strandWeights[i]
 
-        #print weightJointIndexPairs[0].joint_index
-        #print weightJointIndexPairs[0].weight
-        #print influenceObjectsNames[weightJointIndexPairs[0].joint_index]
-        #print weightJointIndexPairs[0].weight
-
-        # Index, the rest should be self explanatory.
-        def getBoneAndWeight(BoneIndex, WeightIndex):
-            if Use_Json:
-                if BoneIndex < len(weightJointIndexPairs) and weightJointIndexPairs[BoneIndex].joint_index < len(influenceObjectsNames):
+            for k in range(0, TRESSFX_MAX_INFLUENTIAL_BONE_COUNT):
+                # slots without weight are padding, they have no bone name in json
+                if weights[k] > 0 and joints[k] < len(influenceObjectsNames):
                     FDict["tfxBoneData"]["skinningData"].append(
                         {
-                            "boneName" : removeBoneNameAscii(influenceObjectsNames[weightJointIndexPairs[BoneIndex].joint_index]),
-                            "weight": weightJointIndexPairs[WeightIndex].weight
+                            "boneName" : removeBoneNameAscii(influenceObjectsNames[joints[k]]),
+                            "weight": weights[k]
                         }
                     )
                 else:
@@ -852,24 +932,12 @@ def SaveTFXBoneBinaryFile(filepath, selected_mesh_shape_name, meshShapedagPath,
                         }
                     )
 
-        if not Use_Json:
-            f.write(ctypes.c_int(i))
-            for i in range(0, len(weightJointIndexPairs)):
-                f.write(ctypes.c_int(weightJointIndexPairs[i].joint_index))
-                f.write(ctypes.c_float(weightJointIndexPairs[i].weight))
-        else: # for json
-            for i in range(0, TRESSFX_MAX_INFLUENTIAL_BONE_COUNT):
-                getBoneAndWeight(i, i)
+    f = open(filepath, "wb")
+    f.write(json.dumps(FDict))
+    f.close()
 
+    return
 
-        progressBar.Increment()
-    # Json Modify
-    #if Use_Json:
-        #f.write(FDict)
-    f.close()
-    progressBar.Kill()
-    return FDict
-           
 def RecursiveSearchCurve(curves, objNode, minCurveLength):
     if objNode.hasFn(OpenMaya.MFn.kNurbsCurve):
         curveFn = OpenMaya.MFnNurbsCurve(objNode)
@@ -918,20 +986,182 @@ class tressfx_float4(ctypes.Structure):
                 ('z', ctypes.c_float),
                 ('w', ctypes.c_float)]
 
+class tressfx_float3(ctypes.Structure):
+    _fields_ = [('x', ctypes.c_float),
+                ('y', ctypes.c_float),
+                ('z', ctypes.c_float)]
+
 class tressfx_float2(ctypes.Structure):
     _fields_ = [('x', ctypes.c_float),
                 ('y', ctypes.c_float)]
+
+def GetCurveSpline(curveFn):
+    # Returns CVs as (x, y, z, weight) in object space, the full knot vector and the degree of the curve.
+    # Maya leaves out the first and the last knot of the usual knot vector so they are added back here.
+    cvArray = OpenMaya.MPointArray()
+    curveFn.getCVs(cvArray, OpenMaya.MSpace.kObject)
+    cvs = [(cvArray[k].x, cvArray[k].y, cvArray[k].z, cvArray[k].w) for k in xrange(cvArray.length())]
+
+    knotArray = OpenMaya.MDoubleArray()
+    curveFn.getKnots(knotArray)
+    knots = [knotArray[k] for k in xrange(knotArray.length())]
+    knots = [knots[0]] + knots + [knots[-1]]
+
+    return cvs, knots, curveFn.degree()
+
+def EvaluateBSplineCurves(cvs, knots, degree, numSamples):
+    # Evaluates curves with the same CV count and degree at once by de Boor's algorithm.
+    # cvs - (numCurves, numCVs, 4) array with weights in w, knots - (numCurves, numCVs + degree + 1) array.
+    # Samples are taken at the same params as getPointAtParam(j / (numSamples - 1) * (max - min)) of the knot domain.
+    # Returns a (numCurves, numSamples, 3) array.
+    numCurves, numCVs = cvs.shape[:2]
+    curveIds = np.arange(numCurves)[:, None]
+
+    domainMin = knots[:, degree:degree + 1]
+    domainMax = knots[:, numCVs:numCVs + 1]
+    params = np.linspace(0.0, 1.0, numSamples)[None, :] * (domainMax - domainMin)
+    params = np.clip(params, domainMin, domainMax)
+
+    # knot span of each param such that knots[span] <= param < knots[span + 1]
+    spans = (knots[:, None, :] <= params[:, :, None]).sum(axis=-1) - 1
+    spans = np.clip(spans, degree, numCVs - 1)
+
+    # CVs in homogeneous coordinates so rational curves come out right too
+    homogeneousCVs = cvs.copy()
+    homogeneousCVs[..., :3] *= cvs[..., 3:]
+    d = [homogeneousCVs[curveIds, spans - degree + j] for j in range(degree + 1)]
+
+    for r in range(1, degree + 1):
+        for j in range(degree, r - 1, -1):
+            left = knots[curveIds, spans + j - degree]
+            width = knots[curveIds, spans + j + 1 - r] - left
+            alpha = np.where(width > 0, (params - left) / np.where(width > 0, width, 1.0), 0.0)[..., None]
+            d[j] = (1.0 - alpha) * d[j - 1] + alpha * d[j]
+
+    return d[degree][..., :3] / d[degree][..., 3:]
+
+def SampleCurves(curves, numVerticesPerStrand):
+    # Samples numVerticesPerStrand points along each curve in object space, evenly spaced in the parameter.
+    # Returns a (numCurves * numVerticesPerStrand, 3) array. Without numpy, it returns a list of (x, y, z) from getPointAtParam.
+    progressBar = ProgressBar('Sampling curves', len(curves))
+
+    if np is None:
+        points = []
+
+        for curveFn in curves:
+            # getting Min/Max value of the nurbs curve
+            min = OpenMaya.MScriptUtil()
+            min.createFromDouble(0) 
+            minPtr = min.asDoublePtr() 
+            max = OpenMaya.MScriptUtil() 
+            max.createFromDouble(0) 
+            maxPtr = max.asDoublePtr() 
+            curveFn.getKnotDomain(minPtr, maxPtr)        
+            min_val = OpenMaya.MScriptUtil(minPtr).asDouble()
+            max_val = OpenMaya.MScriptUtil(maxPtr).asDouble()
+
+            for j in range(0, numVerticesPerStrand):
+                param = j/ float(numVerticesPerStrand-1)       
+                pos = OpenMaya.MPoint()
+                
+                param = param * (max_val - min_val)
+                curveFn.getPointAtParam(param, pos, OpenMaya.MSpace.kObject) # kObject
+                points.append((pos.x, pos.y, pos.z))
+
+            progressBar.Increment()
+
+        progressBar.Kill()
+        return points
+
+    # CVs, knots and degree are read once per curve. Curves with the same CV count and degree are evaluated together.
+    groups = {}
+
+    for i in xrange(len(curves)):
+        cvs, knots, degree = GetCurveSpline(curves[i])
+        groups.setdefault((len(cvs), degree), []).append((i, cvs, knots))
+        progressBar.Increment()
+
+    progressBar.Kill()
+
+    points = np.empty((len(curves), numVerticesPerStrand, 3))
+
+    for (numCVs, degree), group in groups.items():
+        curveIndices = [item[0] for item in group]
+        cvs = np.array([item[1] for item in group], dtype=np.float64)
+        knots = np.array([item[2] for item in group], dtype=np.float64)
+        points[curveIndices] = EvaluateBSplineCurves(cvs, knots, degree, numVerticesPerStrand)
+
+    return points.reshape(-1, 3)
                 
-def SaveTFXBinaryFile(filepath, curves, meshShapedagPath, Use_Json = 0):
+# Returns strand vertices as a ctypes array of tressfx_float4, numVerticesPerStrand per curve, and root positions of curves as MPoints.
+def GetStrandPositions(curves, numVerticesPerStrand, invertZ):
     numCurves = len(curves)
-    numVerticesPerStrand = cmds.optionMenu("numberOfStrandsOptionMenu", query=True, value=True)
-    numVerticesPerStrand = int(numVerticesPerStrand)
-    
-    bothEndsImmovable = cmds.checkBox("bothEndsImmovable",q = True, v = True)
-    invertZ = cmds.checkBox("InvertZ",q = True, v = True)
-     
+
+    strandPoints = SampleCurves(curves, numVerticesPerStrand)
+
+    # all vertices are gathered in a contiguous buffer so that they can be written in one call
+    positions = (tressfx_float4 * (numCurves * numVerticesPerStrand))()
     rootPositions = []
 
+    if np is not None:
+        vertices = np.ones((numCurves, numVerticesPerStrand, 4), dtype=np.float32)
+        vertices[..., :3] = strandPoints.reshape(numCurves, numVerticesPerStrand, 3)
+
+        if invertZ:
+            vertices[..., 2] *= -1.0 # flip in z-axis
+
+        # w component is an inverse mass. The first two vertices are immovable always.
+        vertices[:, :2, 3] = 0
+
+        ctypes.memmove(positions, vertices.ctypes.data, vertices.nbytes)
+
+        # the first sample of each strand is at param 0
+        for rootPos in strandPoints[::numVerticesPerStrand].tolist():
+            rootPositions.append(OpenMaya.MPoint(rootPos[0], rootPos[1], rootPos[2]))
+    else:
+        for i in xrange(numCurves):
+            for j in range(0, numVerticesPerStrand):
+                p = positions[i * numVerticesPerStrand + j]
+                pos = strandPoints[i * numVerticesPerStrand + j]
+                p.x = pos[0]
+                p.y = pos[1]
+
+                if invertZ:
+                    p.z = -pos[2] # flip in z-axis
+                else:
+                    p.z = pos[2]
+
+                # w component is an inverse mass
+                if j == 0 or j == 1: # the first two vertices are immovable always.
+                    p.w = 0
+                else:
+                    p.w = 1.0
+
+            # the first sample is at param 0
+            rootPos = strandPoints[i * numVerticesPerStrand]
+            rootPositions.append(OpenMaya.MPoint(rootPos[0], rootPos[1], rootPos[2]))
+
+    return positions, rootPositions
+
+# Returns strand texture coords from the mesh at each root position of hair strand as a ctypes array of tressfx_float2.
+def GetStrandUVs(meshContext, rootPositions, bInvertYForUVs):
+    rootBindings = meshContext.GetRootBindings(rootPositions)
+    uvs = (tressfx_float2 * len(rootBindings))()
+
+    for i in range(len(rootBindings)):
+        u, v = rootBindings[i].uv
+        uv_coord = uvs[i]
+        uv_coord.x = u
+        uv_coord.y = v
+
+        if bInvertYForUVs:
+            uv_coord.y = 1.0 - uv_coord.y; # DirectX has it inverted
+
+    return uvs
+
+def SaveTFXBinaryFile(filepath, positions, numVerticesPerStrand, uvs):
+    numCurves = len(positions) / numVerticesPerStrand
+
     tfxHeader = TressFXTFXFileHeader()
     tfxHeader.version = 4.0
     tfxHeader.numHairStrands = numCurves
@@ -941,134 +1171,20 @@ def SaveTFXBinaryFile(filepath, curves, meshShapedagPath, Use_Json = 0):
     tfxHeader.offsetVertexUV = 0
     tfxHeader.offsetStrandThickness = 0
     tfxHeader.offsetVertexColor = 0
-    
-    meshFn = None
-    meshIntersector = None
-    
-    # if meshShapedagPath is passed then let's get strand texture coords. To do this, we need MFnMesh and MMeshIntersector objects. 
-    if meshShapedagPath != None:
-        meshFn = OpenMaya.MFnMesh(meshShapedagPath)
-        meshIntersector = OpenMaya.MMeshIntersector()
-        meshIntersector.create(meshShapedagPath.node())
-        tfxHeader.offsetStrandUV = tfxHeader.offsetVertexPosition + numCurves * numVerticesPerStrand * ctypes.sizeof(tressfx_float4)
-  
-    bInvertYForUVs = cmds.checkBox("InvertYForUVs",q = True, v = True)
-  
-    totalProgress = numCurves*numVerticesPerStrand
-    
-    if meshFn != None:
-        totalProgress = numCurves*numVerticesPerStrand + numCurves
-    
-    progressBar = ProgressBar('Saving a tfx file', totalProgress)
 
+    # if uvs are passed then strand texture coords follow the vertices.
+    if uvs != None:
+        tfxHeader.offsetStrandUV = tfxHeader.offsetVertexPosition + ctypes.sizeof(positions)
 
-    f = Internalopen(filepath, "wb", Use_Json)
-    # Json Modify
-    FDict = {}
-    if not Use_Json:
-        f.write(tfxHeader)
-    else:
-        FDict["positions"] = []
-        FDict["uvs"] = []
-        FDict["numVerticesPerStrand"] =tfxHeader.numVerticesPerStrand.__int__()
-        FDict["numHairStrands"] =tfxHeader.numHairStrands.__int__()
-
-    for i in xrange(numCurves):
-        curveFn = curves[i]
-        
-        # getting Min/Max value of the nurbs curve
-        min = OpenMaya.MScriptUtil()
-        min.createFromDouble(0) 
-        minPtr = min.asDoublePtr() 
-        max = OpenMaya.MScriptUtil() 
-        max.createFromDouble(0) 
-        maxPtr = max.asDoublePtr() 
-        curveFn.getKnotDomain(minPtr, maxPtr)        
-        min_val = OpenMaya.MScriptUtil(minPtr).asDouble()
-        max_val = OpenMaya.MScriptUtil(maxPtr).asDouble()
-
-        # Json Modify
-        tmp = []
-        for j in range(0, numVerticesPerStrand):
-            param = j/ float(numVerticesPerStrand-1)       
-            pos = OpenMaya.MPoint()
-            
-            param = param * (max_val - min_val)
-            curveFn.getPointAtParam(param, pos, OpenMaya.MSpace.kObject) # kObject
-            
-            p = tressfx_float4()
-            p.x = pos.x
-            p.y = pos.y
-            
-            if invertZ:
-                p.z = -pos.z # flip in z-axis
-            else:
-                p.z = pos.z
-            
-            # w component is an inverse mass
-            if j == 0 or j == 1: # the first two vertices are immovable always. 
-                p.w = 0
-            else:
-                p.w = 1.0
-
-            if not Use_Json:
-                f.write(p)
-            else:
-                tmp.append(
-                    {
-                        "w":p.w.__float__(),
-                        "x":p.x.__float__(),
-                        "y":p.y.__float__(),
-                        "z":p.z.__float__(),
-                    }
-                )
-            progressBar.Increment()
-        # Json Modify
-        if Use_Json:
-            FDict["positions"].append(tmp)
+    f = open(filepath, "wb")
+    f.write(tfxHeader)
+    f.write(positions)
+    if uvs != None:
+        f.write(uvs)
+    f.close()
 
+    return
 
-        # # find face index
-        rootPos = OpenMaya.MPoint()
-        curveFn.getPointAtParam(0, rootPos, OpenMaya.MSpace.kObject) # kWorld?
-        rootPositions.append(rootPos)
-        
-    # if meshShapedagPath is passed then let's get strand texture coords by using raycasting to the mesh from each root position of hair strand.     
-    if meshFn != None:   
-        for i in range(len(rootPositions)):
-            rootPoint = rootPositions[i]
-        
-             # Find UV coordinates 
-            util = OpenMaya.MScriptUtil()
-            util.createFromList([0.0, 0.0], 2)
-            uv_ptr = util.asFloat2Ptr()
-            meshFn.getUVAtPoint(rootPoint, uv_ptr)
-            u = OpenMaya.MScriptUtil.getFloat2ArrayItem(uv_ptr, 0, 0)
-            v = OpenMaya.MScriptUtil.getFloat2ArrayItem(uv_ptr, 0, 1)
-            uv_coord = tressfx_float2()
-            uv_coord.x = u
-            uv_coord.y = v
-    
-            if bInvertYForUVs:
-                uv_coord.y = 1.0 - uv_coord.y; # DirectX has it inverted
-                
-            #print "uv:%g, %g\n" % (uv_coord.x, uv_coord.y)
-            if not Use_Json:
-                f.write(uv_coord)
-            else:
-                FDict["uvs"].append(
-                    {
-                        "x": uv_coord.x,
-                        "y": uv_coord.y,
-                    }
-                )
-            progressBar.Increment()
-    #f.write(FDict)
-    f.close()
-    progressBar.Kill()
-    
-    return rootPositions, FDict
-    
 class TressFXSkinFileObject(ctypes.Structure):
     _fields_ = [('version', ctypes.c_uint),
                 ('numHairs', ctypes.c_uint),
@@ -1086,133 +1202,49 @@ class HairToTriangleMapping(ctypes.Structure):
                 ('barycentricCoord_z', ctypes.c_float),
                 ('reserved', ctypes.c_uint)]    
     
-def SaveTFXSkinBinaryFile(filepath, meshShapedagPath, rootPositions): 
-    #---------------------------------------------------------------------------
-    # Build a face/triangle index list to convert face index into triangle index
-    #---------------------------------------------------------------------------
-    faceIter = OpenMaya.MItMeshPolygon(meshShapedagPath)
-    triangleCount = 0
-    faceTriaIndexList = []
-    index = 0
-    bInvertYForUVs = cmds.checkBox("InvertYForUVs",q = True, v = True)
-    
-    util = OpenMaya.MScriptUtil()
-    util.createFromInt(0)
-    
-    while not faceIter.isDone():
-        faceTriaIndexList.append(triangleCount)
-        
-        if faceIter.hasValidTriangulation():
-            numTrianglesPtr = util.asIntPtr()
-            faceIter.numTriangles(numTrianglesPtr)
-            numTriangles = util.getInt(numTrianglesPtr)        
-            triangleCount += numTriangles
-
-        faceIter.next()
-   
-    #----------------------
-    # Find the closest face
-    #----------------------
-    meshFn = OpenMaya.MFnMesh(meshShapedagPath)
-    meshIntersector = OpenMaya.MMeshIntersector()
-    meshIntersector.create(meshShapedagPath.node())
+def SaveTFXSkinBinaryFile(filepath, meshContext, rootPositions, bInvertYForUVs): 
     
-    faceIdList = []
-    baryCoordList = []
-    uvCoordList = []
-    progressBar = ProgressBar('Collecting skin data', len(rootPositions))
+    rootBindings = meshContext.GetRootBindings(rootPositions)
     
-    for i in range(len(rootPositions)):
-        rootPoint = rootPositions[i]
-
-        # Find the closest point info
-        meshPt = OpenMaya.MPointOnMesh()
-        meshIntersector.getClosestPoint(rootPoint, meshPt)
-        pt = meshPt.getPoint()
-        
-        pointOnMesh = OpenMaya.MPoint()
-        pointOnMesh = pt
-        
-        # Find face index
-        faceId = meshPt.faceIndex()
-        
-        # Find triangle index
-        triangleId = faceTriaIndexList[faceId] + meshPt.triangleIndex()
-        faceIdList.append(triangleId)
-        
-        # Find barycentric coordinates
-        uPtr = OpenMaya.MScriptUtil().asFloatPtr()
-        vPtr = OpenMaya.MScriptUtil().asFloatPtr()
-        meshPt.getBarycentricCoords(uPtr,vPtr)
-        uvw = OpenMaya.MPoint()
-        uvw.x = OpenMaya.MScriptUtil(uPtr).asFloat()
-        uvw.y = OpenMaya.MScriptUtil(vPtr).asFloat()
-        uvw.z = 1.0 - uvw.x - uvw.y  
-        baryCoordList.append(uvw)
-        
-        # TODO: Why are there negative barycentric coords?
-        #if uvw.x < 0 or uvw.y < 0 or uvw.z < 0:
-        #    print 'uvw:', uvw.x, uvw.y, uvw.z
-        
-        # Find UV coordinates 
-        util = OpenMaya.MScriptUtil()
-        util.createFromList([0.0, 0.0], 2)
-        uv_ptr = util.asFloat2Ptr()
-        meshFn.getUVAtPoint(rootPoint, uv_ptr)
-        u = OpenMaya.MScriptUtil.getFloat2ArrayItem(uv_ptr, 0, 0)
-        v = OpenMaya.MScriptUtil.getFloat2ArrayItem(uv_ptr, 0, 1)
-        uv_coord = OpenMaya.MPoint()
-        uv_coord.x = u
-        uv_coord.y = v
-        uv_coord.z = 0
-        uvCoordList.append(uv_coord)
-
-        # update progress gui
-        progressBar.Increment()
-        
-    progressBar.Kill()
-
     #--------------------
     # Save a tfxskin file
     #--------------------
     tfxSkinObj = TressFXSkinFileObject()
     tfxSkinObj.version = 1
-    tfxSkinObj.numHairs = len(faceIdList)
+    tfxSkinObj.numHairs = len(rootBindings)
     tfxSkinObj.numTriangles = 0
     tfxSkinObj.hairToMeshMap_Offset = ctypes.sizeof(TressFXSkinFileObject)
-    tfxSkinObj.perStrandUVCoordniate_Offset = tfxSkinObj.hairToMeshMap_Offset + len(faceIdList) * ctypes.sizeof(HairToTriangleMapping)
+    tfxSkinObj.perStrandUVCoordniate_Offset = tfxSkinObj.hairToMeshMap_Offset + len(rootBindings) * ctypes.sizeof(HairToTriangleMapping)
     
-    f = Internalopen(filepath, "wb")
-    f.write(tfxSkinObj)
+    progressBar = ProgressBar('Saving a tfxskin file', len(rootBindings))
     
-    progressBar = ProgressBar('Saving a tfxskin file', len(faceIdList) + len(uvCoordList))
+    mappings = (HairToTriangleMapping * len(rootBindings))()
+    uvs = (tressfx_float3 * len(rootBindings))() # per strand uv coordinate
     
-    for i in xrange(len(faceIdList)):
-        mapping = HairToTriangleMapping()
+    for i in xrange(len(rootBindings)):
+        mapping = mappings[i]
         mapping.mesh = 0
-        mapping.triangle = faceIdList[i]
+        mapping.triangle = rootBindings[i].triangleId
         
-        uvw = baryCoordList[i]
-        mapping.barycentricCoord_x = uvw.x
-        mapping.barycentricCoord_y = uvw.y
-        mapping.barycentricCoord_z = uvw.z
+        uvw = rootBindings[i].meshBaryCoord
+        mapping.barycentricCoord_x = uvw[0]
+        mapping.barycentricCoord_y = uvw[1]
+        mapping.barycentricCoord_z = uvw[2]
         
-        f.write(mapping)
-        progressBar.Increment()
-        
-    # per strand uv coordinate
-    for i in xrange(len(uvCoordList)):
-        uv_coord = uvCoordList[i]
-        p = Point()
-        p.x = uv_coord.x
+        uv_coord = rootBindings[i].uv
+        uvs[i].x = uv_coord[0]
         
         if bInvertYForUVs:
-            p.y = 1.0 - uv_coord.y # DirectX has it inverted
+            uvs[i].y = 1.0 - uv_coord[1] # DirectX has it inverted
+        else:
+            uvs[i].y = uv_coord[1]
         
-        p.z = uv_coord.z         
-        f.write(p)    
         progressBar.Increment()
-    
+        
+    f = open(filepath, "wb")
+    f.write(tfxSkinObj)
+    f.write(mappings)
+    f.write(uvs)
     f.close()
     progressBar.Kill()
      
@@ -1305,48 +1337,8 @@ def ExportMesh(filepath, meshShapedagPath):
         influenceName = dagPaths[i].partialPathName()        
         influenceObjectsNames.append(influenceName) # Need to remove namespace?
     
-    skinMeshes = cmds.skinCluster(skinClusterName, query=1, geometry=1)
-    geoIter = OpenMaya.MItGeometry(meshShapedagPath)
-    infCount = OpenMaya.MScriptUtil()
-    infCountPtr = infCount.asUintPtr()   
-    numVertices = geoIter.count()
-    
-    weightArray = [0] * TRESSFX_MAX_INFLUENTIAL_BONE_COUNT  * numVertices # joint weight array for all vertices. Each vertex will have TRESSFX_MAX_INFLUENTIAL_BONE_COUNT  weights. 
-                                                         # It is initialized with zero for empty weight in case there are less weights than TRESSFX_MAX_INFLUENTIAL_BONE_COUNT .
-    jointIndexArray = [-1] * TRESSFX_MAX_INFLUENTIAL_BONE_COUNT  * numVertices # joint index array for all vertices. It is initialized with -1 for an empty element in case 
-                                                              # there are less weights than TRESSFX_MAX_INFLUENTIAL_BONE_COUNT . 
-
     # collect bone weights for all vertices in the mesh
-    index = 0
-
-    progressBar = ProgressBar('Collect data', numVertices)
-    
-    while geoIter.isDone() == False:
-        weights = OpenMaya.MDoubleArray()
-        skinFn.getWeights(meshShapedagPath, geoIter.currentItem(), weights, infCountPtr)
-        
-        weightJointIndexPairs = []
-        
-        for i in range(len(weights)):
-            pair = WeightJointIndexPair()
-            pair.weight = weights[i]
-            pair.joint_index = i 
-            weightJointIndexPairs.append(pair)
-    
-        weightJointIndexPairs.sort() #all zero weight will be sorted behind
-        
-        a = 0
-
-        for j in range(min(len(weightJointIndexPairs), TRESSFX_MAX_INFLUENTIAL_BONE_COUNT )):
-            weightArray[index*TRESSFX_MAX_INFLUENTIAL_BONE_COUNT  + a] = weightJointIndexPairs[j].weight
-            jointIndexArray[index*TRESSFX_MAX_INFLUENTIAL_BONE_COUNT  + a] = weightJointIndexPairs[j].joint_index
-            a += 1
-
-        index += 1
-        progressBar.Increment()
-        geoIter.next()
-
-    progressBar.Kill()
+    jointIndexArray, weightArray = GetSortedJointWeights(skinFn, meshShapedagPath, TRESSFX_MAX_INFLUENTIAL_BONE_COUNT)
     
     #----------------------------------------------------------    
     # We collected all necessary data. Now save them in file.  
@@ -1354,7 +1346,7 @@ def ExportMesh(filepath, meshShapedagPath):
     totalProgress = points.length() + triangleVertexIndices.length() / 3 + len(influenceObjectsNames)
     progressBar = ProgressBar('Export collision mesh', totalProgress)    
 
-    f = Internalopen(filepath, "w")
+    f = open(filepath, "w")
     f.write("# TressFX collision mesh exported by TressFX Exporter in Maya\n")
     
     # Write all bone (joint) names